@@ -9,8 +9,9 @@ from tkinter import ttk
 # === För video-dekod & protokoll ===
 import struct
 import io
+from collections import deque
 try:
-    from PIL import Image, ImageTk
+    from PIL import Image, ImageTk, ImageDraw
 except ImportError:
     raise SystemExit("Installera Pillow först: pip install pillow")
 
@@ -128,12 +129,25 @@ vsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 vsock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 try:
     vsock.connect((PI_IP, VIDEO_PORT))
+    vsock.sendall(b"FH\x02")   # Be om ramheader v2 (kamera/frame_header.py)
     video_connected = True
 except OSError as e:
     print(f"[Video] kunde inte ansluta till {PI_IP}:{VIDEO_PORT}: {e}")
     video_connected = False
     vsock = None
 
+# Overlay-port (geometri per ram från Pi:n, ritas här i stället för på Pi:n)
+OVERLAY_PORT = int(sys.argv[4]) if len(sys.argv) > 4 else VIDEO_PORT + 1
+osock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+osock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+try:
+    osock.connect((PI_IP, OVERLAY_PORT))
+    overlay_connected = True
+except OSError as e:
+    print(f"[Overlay] kunde inte ansluta till {PI_IP}:{OVERLAY_PORT}: {e}")
+    overlay_connected = False
+    osock = None
+
 # === Root Window Setup ===
 
 root = tk.Tk()
@@ -889,6 +903,27 @@ cam_label = tk.Label(
 )
 cam_label.pack(padx=10, pady=10)
 _cam_img_ref = None  # behåll referens så bilden inte garbage-collectas
+
+# Strömmens aktuella kvalitet/skala (JPEG COM-segment från Pi:n)
+cam_info_v = tk.StringVar(value="")
+tk.Label(
+    camera_card,
+    textvariable=cam_info_v,
+    bg=card_bg,
+    fg=accent,
+    font=("Consolas", 9),
+).pack(anchor="w", padx=10)
+
+# Latens, tappade ramar och tid per steg (ramheader från Pi:n)
+cam_stats_v = tk.StringVar(value="")
+tk.Label(
+    camera_card,
+    textvariable=cam_stats_v,
+    bg=card_bg,
+    fg=accent,
+    font=("Consolas", 9),
+    justify="left",
+).pack(anchor="w", padx=10)
 CAM_W, CAM_H = 400, 300  # visningsstorlek
 
 if not video_connected:
@@ -1032,7 +1067,181 @@ def update_cam_image(pil_img):
     cam_label.config(image=tk_img, text="")
 
 
+# === Overlay-meddelanden (matchar kamera/overlay_protocol.py) ===
+OVERLAY_MAGIC = b"OV"
+OVERLAY_VERSION = 2
+OVERLAY_HEADER = struct.Struct("!2sBBIfHHhhhhhhhhh")
+
+overlays = {}                 # seq -> overlay dict, bara de senaste
+overlays_lock = threading.Lock()
+last_video_time = 0.0
+
+
+def unpack_overlay(data: bytes):
+    (magic, version, flags, seq, heading, frame_w, frame_h, roi_x, roi_y,
+     stop_x, stop_y, stop_x0, stop_x1, target_x, target_y, cam_x_off) = OVERLAY_HEADER.unpack_from(data)
+    if magic != OVERLAY_MAGIC or version != OVERLAY_VERSION:
+        return None
+
+    pos = OVERLAY_HEADER.size
+    lines = []
+    for _ in range(4):
+        (n,) = struct.unpack_from("!H", data, pos)
+        pos += 2
+        vals = struct.unpack_from(f"!{2 * n}h", data, pos)
+        lines.append(list(zip(vals[0::2], vals[1::2])))
+        pos += 4 * n
+
+    return {
+        "seq": seq,
+        "heading": heading,
+        "intersection": bool(flags & 0x01),
+        "frame_size": (frame_w, frame_h),
+        "roi_offset": (roi_x, roi_y),
+        "cam_x_offset": cam_x_off,
+        "stop": (stop_x, stop_y, stop_x0, stop_x1) if flags & 0x02 else None,
+        "target": (target_x, target_y) if flags & 0x04 else None,
+        "left": lines[0],
+        "right": lines[1],
+        "target_path": lines[2],
+        "other_path": lines[3],
+    }
+
+
+def parse_stream_info(comment: bytes) -> dict:
+    """ 'seq=12;q=60;scale=half' -> dict """
+    info = {}
+    for part in comment.decode("ascii", "ignore").split(";"):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            info[k] = v
+    return info
+
+
+def draw_overlay(img, ov, scale_mode="full"):
+    """
+    Rita overlay (fullbildskoordinater) på img. scale_mode anger hur Pi:n
+    skalade bilden: "full", "half" eller "roi" (bara ROI-utsnittet).
+    """
+    ox, oy = ov["roi_offset"] if scale_mode == "roi" else (0, 0)
+    k = 0.5 if scale_mode == "half" else 1.0
+
+    def tf(p):
+        return ((p[0] - ox) * k, (p[1] - oy) * k)
+
+    draw = ImageDraw.Draw(img)
+    for key, color, width in (("left", (255, 0, 0), 4), ("right", (255, 0, 0), 4),
+                              ("target_path", (255, 200, 0), 3), ("other_path", (100, 70, 0), 3)):
+        pts = [tf(p) for p in ov[key]]
+        if len(pts) > 1:
+            draw.line(pts, fill=color, width=width)
+
+    if ov["stop"]:
+        sx, sy, sx0, sx1 = ov["stop"]
+        draw.line([tf((sx0, sy)), tf((sx1, sy))], fill=(220, 0, 0), width=2)
+        draw.text(tf((sx0 + 8, sy - 20)), "STOP", fill=(240, 10, 0))
+
+    if ov["target"]:
+        fw, fh = ov["frame_size"]
+        tx, ty = tf(ov["target"])
+        origin_x = fw // 2 + ov["cam_x_offset"]    # config.CAMERA_X_OFFSET på Pi:n
+        draw.line([tf((origin_x, fh - 1)), (tx, ty)], fill=(180, 70, 0), width=2)
+        draw.ellipse([tx - 6, ty - 6, tx + 6, ty + 6], fill=(240, 70, 0))
+
+    heading_color = (255, 200, 0) if ov["intersection"] else (245, 245, 245)
+    draw.rectangle([0, 0, 70, 24], fill=(0, 0, 0))
+    draw.text((6, 6), f"{ov['heading']:.1f}", fill=heading_color)
+    return img
+
+
+def rx_overlay():
+    if not overlay_connected or osock is None:
+        return
+    try:
+        while True:
+            hdr = recv_exact(osock, 4)
+            if not hdr:
+                break
+            (length,) = struct.unpack("!I", hdr)
+            data = recv_exact(osock, length)
+            if not data:
+                break
+            try:
+                ov = unpack_overlay(data)
+            except struct.error:
+                continue
+            if ov is None:
+                continue
+
+            with overlays_lock:
+                overlays[ov["seq"]] = ov
+                for old in [k for k in overlays if k < ov["seq"] - 30]:
+                    del overlays[old]
+
+            # Bara geometri (ingen video på en stund) -> rita på tom bild
+            if time.time() - last_video_time > 1.0:
+                blank = Image.new("RGB", ov["frame_size"], (30, 30, 30))
+                root.after(0, update_cam_image, draw_overlay(blank, ov))
+    except OSError as e:
+        append_log(f"Overlay error: {e}")
+    finally:
+        try:
+            if osock:
+                osock.close()
+        except Exception:
+            pass
+
+
+# === Ramheader v2 (matchar kamera/frame_header.py) ===
+FRAME_MAGIC = b"FH"
+FRAME_HEADER = struct.Struct("!2sBBHIQQQQqIIIIII")
+clock_offsets = deque(maxlen=200)   # mottagen - skickad väggklocka (us)
+
+
+def unpack_frame_header(data: bytes):
+    """ Returnerar (header dict, JPEG-bytes), header None för gammalt format. """
+    if len(data) < FRAME_HEADER.size or data[:2] != FRAME_MAGIC:
+        return None, data
+    (_, version, _flags, header_len, seq, capture_us, vision_done_us, encode_done_us,
+     sent_us, sent_wall_us, vision_us, overlay_us, jpeg_us,
+     capture_dropped, encode_dropped, stream_dropped) = FRAME_HEADER.unpack_from(data)
+    hdr = {
+        "seq": seq,
+        "capture_us": capture_us,
+        "vision_done_us": vision_done_us,
+        "encode_done_us": encode_done_us,
+        "sent_us": sent_us,
+        "sent_wall_us": sent_wall_us,
+        "vision_us": vision_us,
+        "overlay_us": overlay_us,
+        "jpeg_us": jpeg_us,
+        "dropped": (capture_dropped, encode_dropped, stream_dropped),
+    }
+    return hdr, data[header_len:]
+
+
+def format_frame_stats(hdr, recv_wall_us: int) -> str:
+    """
+    Glas-till-glas ≈ (kamera -> skickad, Pi:ns klocka) + nätverk. Nätverket
+    mäts med väggklockorna; går PC:ns klocka efter Pi:ns antas den minsta
+    uppmätta fördröjningen vara 0.
+    """
+    net = recv_wall_us - hdr["sent_wall_us"]
+    clock_offsets.append(net)
+    skew = min(clock_offsets)
+    if skew < 0:
+        net -= skew
+    pi_ms = (hdr["sent_us"] - hdr["capture_us"]) / 1000
+    net_ms = net / 1000
+    cap, enc, strm = hdr["dropped"]
+    return (f"Latens {pi_ms + net_ms:.0f} ms (Pi {pi_ms:.0f} + nät {net_ms:.0f})  #{hdr['seq']}\n"
+            f"Vision {hdr['vision_us'] / 1000:.1f}  overlay {hdr['overlay_us'] / 1000:.1f}  "
+            f"jpeg {hdr['jpeg_us'] / 1000:.1f} ms\n"
+            f"Tappade: kamera {cap}  encode {enc}  ström {strm}")
+
+
 def rx_video():
+    global last_video_time
     if not video_connected or vsock is None:
         return
     try:
@@ -1046,11 +1255,29 @@ def rx_video():
             if not data:
                 append_log("Video: ström avslutad (payload)")
                 break
+            recv_wall_us = time.time_ns() // 1000
+            frame_hdr, data = unpack_frame_header(data)
+            if frame_hdr:
+                root.after(0, cam_stats_v.set, format_frame_stats(frame_hdr, recv_wall_us))
             try:
-                img = Image.open(io.BytesIO(data)).convert("RGB")
+                img = Image.open(io.BytesIO(data))
+                comment = img.info.get("comment", b"")
+                img = img.convert("RGB")
             except Exception:
                 continue
+
+            info = parse_stream_info(comment)
+            ov = None
+            if "seq" in info:
+                with overlays_lock:
+                    ov = overlays.get(int(info["seq"]))
+            if ov:
+                draw_overlay(img, ov, info.get("scale", "full"))
+
+            last_video_time = time.time()
             root.after(0, update_cam_image, img)
+            if comment:
+                root.after(0, cam_info_v.set, comment.decode("ascii", "ignore"))
     except OSError as e:
         append_log(f"Video error: {e}")
     finally:
@@ -1061,9 +1288,10 @@ def rx_video():
             pass
 
 
-# Start telemetry + video threads
+# Start telemetry + video + overlay threads
 threading.Thread(target=rx_telemetry, daemon=True).start()
 threading.Thread(target=rx_video, daemon=True).start()
+threading.Thread(target=rx_overlay, daemon=True).start()
 
 
 # === Clicking outside: DON'T steal focus from Entry widgets ===
@@ -1089,6 +1317,11 @@ def on_close():
             vsock.close()
     except Exception:
         pass
+    try:
+        if osock:
+            osock.close()
+    except Exception:
+        pass
     root.destroy()
 
 
@@ -0,0 +1,128 @@
+"""
+Adaptive JPEG encoding for the video stream.
+
+Steps through a ladder of (scale, quality) levels to hold the stream
+latency near config.STREAM_TARGET_LATENCY_MS. Latency is estimated per
+client from the streamer: queue-to-wire time plus the time the kernel
+send backlog needs to drain at the measured throughput. The worst client
+decides.
+
+The current level (and frame seq, if given) is written into the JPEG as
+a COM segment ("seq=12;q=60;scale=half"), so old clients keep working
+and the GUI can show it / match it with the overlay message.
+"""
+import time
+from typing import List, Optional, Tuple
+import cv2
+import numpy as np
+import config
+from profiler import profiler
+
+# Best -> worst. scale: "full", "half" or "roi" (ROI crop only)
+LEVELS: List[Tuple[str, int]] = [
+    ("full", 80),
+    ("full", 60),
+    ("full", 45),
+    ("half", 60),
+    ("half", 45),
+    ("roi", 45),
+    ("roi", 30),
+]
+DEFAULT_LEVEL = 1               # full, q=60 (the old fixed setting)
+STEP_DOWN_FACTOR = 1.5          # Worse when latency > target * this
+STEP_UP_FACTOR = 0.5            # Better when latency < target * this ...
+STEP_UP_HOLD = 2.0              # ... for this many seconds
+STEP_COOLDOWN = 0.5             # Min seconds between two steps
+
+
+def estimate_latency_ms(client_stats: list) -> float:
+    """
+    Worst estimated latency over all clients.
+    """
+    worst = 0.0
+    for c in client_stats:
+        rate_bps = c["kbps"] * 1000 / 8
+        drain_ms = c["backlog_bytes"] / rate_bps * 1000 if rate_bps > 0 else 0.0
+        worst = max(worst, c["latency_ms"] + drain_ms)
+    return worst
+
+
+def _comment_segment(text: str) -> bytes:
+    data = text.encode("ascii")
+    return b"\xff\xfe" + (len(data) + 2).to_bytes(2, "big") + data
+
+
+class AdaptiveJpegEncoder:
+    def __init__(self, target_latency_ms: float = config.STREAM_TARGET_LATENCY_MS,
+                 level: int = DEFAULT_LEVEL):
+        self.target_latency_ms = target_latency_ms
+        self.level = level
+        self._last_step = 0.0
+        self._good_since: Optional[float] = None
+        self._dropped_seen = 0
+
+    @property
+    def setting(self) -> Tuple[str, int]:
+        return LEVELS[self.level]
+
+    def update(self, client_stats: list) -> None:
+        """
+        Adjust level from the streamer's client_stats(). Call once per frame.
+        """
+        if not client_stats:
+            return
+
+        now = time.monotonic()
+        latency = estimate_latency_ms(client_stats)
+        total_dropped = sum(c["dropped"] for c in client_stats)
+        dropped = total_dropped > self._dropped_seen
+        self._dropped_seen = total_dropped
+
+        if latency < self.target_latency_ms * STEP_UP_FACTOR and not dropped:
+            if self._good_since is None:
+                self._good_since = now
+        else:
+            self._good_since = None
+
+        if now - self._last_step < STEP_COOLDOWN:
+            return
+
+        if latency > self.target_latency_ms * STEP_DOWN_FACTOR and self.level < len(LEVELS) - 1:
+            self.level += 1
+            self._last_step = now
+            self._good_since = None
+        elif (self._good_since is not None
+              and now - self._good_since > STEP_UP_HOLD and self.level > 0):
+            self.level -= 1
+            self._last_step = now
+            self._good_since = None
+
+    def encode(self, frame: np.ndarray, roi_rect: Tuple[int, int, int, int],
+               seq: Optional[int] = None) -> Optional[list]:
+        """
+        Encode frame at the current level. roi_rect = (top, bottom, left, right).
+        Returns the JPEG as a list of buffers (SOI, COM segment, rest) for
+        FrameTCPStreamer.push_parts, or None if encoding failed.
+        """
+        scale, quality = self.setting
+        t = profiler.start()
+
+        if scale == "half":
+            img = cv2.resize(frame, (frame.shape[1] // 2, frame.shape[0] // 2),
+                             interpolation=cv2.INTER_AREA)
+        elif scale == "roi":
+            top, bottom, left, right = roi_rect
+            img = frame[top:bottom, left:right]
+        else:
+            img = frame
+
+        ok, jpg = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        profiler.lap("jpeg", t)
+        if not ok:
+            return None
+
+        jpg = jpg.reshape(-1)
+        comment = f"q={quality};scale={scale}"
+        if seq is not None:
+            comment = f"seq={seq};" + comment
+        return [jpg[:2], _comment_segment(comment), jpg[2:]]
@@ -0,0 +1,255 @@
+"""
+Black-box recorder: the last frames the car saw, in a memory-mapped ring file.
+
+Every frame writes one fixed-size slot (a small record + the grayscale
+pixels, ROI only with BLACKBOX_ROI_ONLY) into a preallocated file, so the
+cost per frame is one memcpy and a few scalar stores. freeze() copies the
+last BLACKBOX_FREEZE_SECONDS out of the ring and writes them, in order,
+to a file of the same format in BLACKBOX_DIR. Copying and writing happen
+on a background thread.
+
+File layout: 64-byte header (HEADER_DTYPE), then `capacity` slots
+(slot_dtype). BlackBoxReader opens both ring and frozen files with
+random access, replay_benchmark.py loads them like an image directory.
+"""
+import os
+import threading
+import time
+from typing import Optional, Tuple
+import numpy as np
+import config
+
+MAGIC = b"BBX1"
+VERSION = 1
+HEADER_SIZE = 64
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u4"),
+    ("capacity", "<u4"),
+    ("height", "<u4"),
+    ("width", "<u4"),
+    ("full_height", "<u4"),
+    ("full_width", "<u4"),
+    ("roi_top", "<u4"),
+    ("roi_left", "<u4"),
+    ("write_count", "<u8"),
+])
+
+RECORD_DTYPE = np.dtype([
+    ("seq", "<u4"),
+    ("capture_ns", "<u8"),
+    ("heading", "<f4"),
+    ("target_x", "<i2"),
+    ("target_y", "<i2"),
+    ("dist_to_stop", "<f4"),        # NaN if no stop line
+    ("median_lane_width", "<f4"),   # NaN if unknown
+    ("flags", "<u2"),
+    ("action", "u1"),               # Route command char (V/H/S/B)
+    ("direction", "u1"),
+])
+
+# flags
+STOP_SEEN = 0x001
+OTHER_PATH = 0x002
+BOTH_EDGES = 0x004
+TRACKED = 0x008
+SCANLINE = 0x010
+INTERSECTION_ACTIVE = 0x020
+STOP_SECTION_ACTIVE = 0x040
+WAITING = 0x080
+
+
+def slot_dtype(height: int, width: int) -> np.dtype:
+    return np.dtype([("rec", RECORD_DTYPE), ("pixels", "u1", (height, width))])
+
+
+class BlackBoxRecorder:
+    def __init__(self, path: str, capacity: int, full_shape: Tuple[int, int],
+                 roi: Optional[Tuple[int, int, int, int]] = None):
+        """
+        full_shape: (h, w) of the grayscale frame. roi: (top, bottom, left,
+        right) to store only that part, None = whole frame.
+        """
+        full_h, full_w = full_shape
+        top, bottom, left, right = roi if roi else (0, full_h, 0, full_w)
+        self._rows = slice(top, bottom)
+        self._cols = slice(left, right)
+        self.capacity = capacity
+        h, w = bottom - top, right - left
+        self._slot_dtype = slot_dtype(h, w)
+
+        size = HEADER_SIZE + capacity * self._slot_dtype.itemsize
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "wb") as f:
+            f.truncate(size)
+
+        self._header = np.memmap(path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+        self._header[0] = (MAGIC, VERSION, capacity, h, w, full_h, full_w, top, left, 0)
+        self._slots = np.memmap(path, dtype=self._slot_dtype, mode="r+",
+                                offset=HEADER_SIZE, shape=(capacity,))
+        self._rec = self._slots["rec"]
+        self._pixels = self._slots["pixels"]
+        self.count = 0
+        self._last_freeze = 0.0
+        os.makedirs(config.BLACKBOX_DIR, exist_ok=True)
+
+    def record(self, seq: int, capture_ns: int, gray: np.ndarray, res, state) -> None:
+        """
+        Store one frame. res: FrameResult or None (waiting for route),
+        state: DriveStateMachine.
+        """
+        i = self.count % self.capacity
+        np.copyto(self._pixels[i], gray[self._rows, self._cols])
+
+        flags = 0
+        if state.intersection_is_active:
+            flags |= INTERSECTION_ACTIVE
+        if state.stop_section_active:
+            flags |= STOP_SECTION_ACTIVE
+
+        if res is None:
+            self._rec[i] = (seq, capture_ns, 0.0, -1, -1, np.nan, np.nan, flags | WAITING,
+                            ord(state.next_action.value), state.dir.value)
+        else:
+            if res.stop_point is not None:
+                flags |= STOP_SEEN
+            if res.other_path is not None:
+                flags |= OTHER_PATH
+            if res.both_edges_found:
+                flags |= BOTH_EDGES
+            if res.tracked:
+                flags |= TRACKED
+            if res.scanline:
+                flags |= SCANLINE
+            tx, ty = (int(v) for v in res.target_point) if res.target_point is not None else (-1, -1)
+            self._rec[i] = (
+                seq, capture_ns, res.heading, tx, ty,
+                np.nan if res.dist_to_stopline is None else res.dist_to_stopline,
+                np.nan if res.median_lane_width is None else res.median_lane_width,
+                flags, ord(state.next_action.value), state.dir.value,
+            )
+
+        # Count last, a reader never sees a half-written newest slot
+        self.count += 1
+        self._header["write_count"][0] = self.count
+
+    def _ordered(self) -> np.ndarray:
+        """ Slot indices, oldest first. """
+        n = min(self.count, self.capacity)
+        start = self.count - n
+        return (start + np.arange(n)) % self.capacity
+
+    def freeze(self, reason: str, seconds: float = None) -> Optional[str]:
+        """
+        Pick the last `seconds` of the ring and copy them to BLACKBOX_DIR
+        in the background. Returns the file path, None if nothing was
+        recorded, the last freeze was too recent or the thread could not
+        be started. Never raises, the caller is the control loop.
+        """
+        seconds = config.BLACKBOX_FREEZE_SECONDS if seconds is None else seconds
+        now = time.monotonic()
+        if self.count == 0 or now - self._last_freeze < config.BLACKBOX_FREEZE_COOLDOWN:
+            return None
+        self._last_freeze = now
+
+        # Only the small records are read here, the pixels are copied by
+        # the writer thread
+        order = self._ordered()
+        ts = self._rec["capture_ns"][order].astype(np.int64)
+        writes = self.count - len(order) + np.flatnonzero(ts >= ts[-1] - int(seconds * 1e9))
+
+        header = np.array(self._header).copy()
+
+        name = time.strftime("freeze_%Y%m%d_%H%M%S") + f"_{reason}.bbx"
+        path = os.path.join(config.BLACKBOX_DIR, name)
+        try:
+            threading.Thread(target=self._write_frozen, args=(path, header, writes), daemon=True).start()
+        except (OSError, RuntimeError) as e:
+            print(f"Black box: could not freeze {path}: {e}")
+            return None
+        return path
+
+    def _write_frozen(self, path: str, header: np.ndarray, writes: np.ndarray) -> None:
+        """
+        Copy the slots of the given write numbers out of the ring into a
+        new file. A slot the ring overwrote before its copy finished is
+        skipped.
+        """
+        tmp = path + ".tmp"
+        kept = 0
+        try:
+            with open(tmp, "wb") as f:
+                f.seek(HEADER_SIZE)
+                for w in writes.tolist():
+                    i = w % self.capacity
+                    slot = np.array(self._slots[i:i + 1])
+                    # Write w + capacity reuses the slot, it starts once count reaches it
+                    if self.count >= w + self.capacity:
+                        continue
+                    f.write(slot.tobytes())
+                    kept += 1
+
+                header["capacity"] = kept
+                header["write_count"] = kept
+                f.seek(0)
+                f.write(header.tobytes().ljust(HEADER_SIZE, b"\0"))
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Black box: could not write {path}: {e}")
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        print(f"Black box: {kept} frames -> {path} ({len(writes) - kept} overwritten)")
+
+    def close(self) -> None:
+        self._slots.flush()
+        self._header.flush()
+
+
+class BlackBoxReader:
+    """
+    Random access to a ring or frozen black-box file, oldest frame first.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.header = np.memmap(path, dtype=HEADER_DTYPE, mode="r", shape=(1,))[0]
+        if self.header["magic"] != MAGIC:
+            raise ValueError(f"Not a black-box file: {path}")
+        capacity = int(self.header["capacity"])
+        self._slots = np.memmap(path, dtype=slot_dtype(int(self.header["height"]), int(self.header["width"])),
+                                mode="r", offset=HEADER_SIZE, shape=(capacity,))
+
+        count = int(self.header["write_count"])
+        n = min(count, capacity)
+        self._order = (count - n + np.arange(n)) % capacity
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    @property
+    def records(self) -> np.ndarray:
+        """ All records in order (structured array, RECORD_DTYPE). """
+        return self._slots["rec"][self._order]
+
+    def record(self, i: int) -> dict:
+        rec = self._slots["rec"][self._order[i]]
+        return {name: rec[name].item() for name in RECORD_DTYPE.names}
+
+    def pixels(self, i: int) -> np.ndarray:
+        """ Stored pixels (ROI or whole frame), a read-only view into the file. """
+        return self._slots["pixels"][self._order[i]]
+
+    def frame(self, i: int) -> np.ndarray:
+        """ Full-size grayscale frame, area outside a stored ROI filled white (no tape). """
+        h, w = int(self.header["full_height"]), int(self.header["full_width"])
+        top, left = int(self.header["roi_top"]), int(self.header["roi_left"])
+        px = self.pixels(i)
+        if px.shape == (h, w):
+            return np.array(px)
+        full = np.full((h, w), 255, dtype=np.uint8)
+        full[top:top + px.shape[0], left:left + px.shape[1]] = px
+        return full
@@ -0,0 +1,287 @@
+"""
+Lane boundary validation.
+
+Two implementations of each check:
+    - list:  plain Python loops, cheap for short inputs
+    - array: numpy, scales better with length
+
+With config.BOUNDARY_VALIDATION = "auto" each call goes to the faster one
+for its length: calibrate() times both once on synthetic boundaries of
+realistic length (picam does it at startup), DEFAULT_CROSSOVER until then.
+Run this file directly to print the benchmark:
+
+    python boundary_validation.py
+"""
+import argparse
+import time
+import numpy as np
+import config
+
+_EMPTY = np.empty((0, 2), dtype=np.int32)
+LANE_LIKE_MIN_RATIO = 2/5
+BENCH_LENGTHS = (25, 50, 100, 200, 300, 400)
+
+
+# ----------------------------------------------------------
+# Lane-likeness (is the boundary mostly vertical?)
+# ----------------------------------------------------------
+def is_lane_like_list(pts) -> bool:
+    if hasattr(pts, "tolist"):
+        pts = pts.tolist()
+
+    n = len(pts)
+    if n < 2:
+        return False
+
+    dx = []
+    dy = []
+
+    for i in range(n - 1):
+        x1, y1 = pts[i]
+        x2, y2 = pts[i+1]
+        dx.append(abs(x2 - x1))
+        dy.append(abs(y2 - y1))
+
+    dx_sorted = sorted(dx)
+    q90 = dx_sorted[int(0.9 * len(dx_sorted))]
+
+    # Check vertical behavior
+    for i in range(len(dx)):
+        if dx[i] <= q90:
+            ratio = dy[i] / (dx[i] if dx[i] > 1 else 1)
+            if ratio < LANE_LIKE_MIN_RATIO:
+                return False
+
+    return True
+
+
+def is_lane_like_array(pts) -> bool:
+    pts = np.asarray(pts)
+    if len(pts) < 2:
+        return False
+
+    d = np.abs(np.diff(pts, axis=0))
+    dx = d[:, 0]
+    dy = d[:, 1]
+
+    k = int(0.9 * len(dx))
+    q90 = np.partition(dx, k)[k]
+
+    sel = dx <= q90
+    ratio = dy[sel] / np.maximum(dx[sel], 1)
+    return not (ratio < LANE_LIKE_MIN_RATIO).any()
+
+
+# ----------------------------------------------------------
+# Outward-from-middle deviation filter
+# ----------------------------------------------------------
+def safety_limit_list(boundary) -> np.ndarray:
+    if boundary is None or len(boundary) == 0:
+        return _EMPTY
+
+    if hasattr(boundary, "tolist"):
+        boundary = boundary.tolist()
+
+    boundary.sort(key=lambda p: p[1])
+
+    n = len(boundary)
+    mid = n // 2
+    mid_x, mid_y = boundary[mid]
+
+    cleaned = [None] * n
+    cleaned[mid] = (mid_x, mid_y)
+
+    # Downward expansion
+    prev_x = mid_x
+    for i in range(mid + 1, n):
+        x, y = boundary[i]
+        if abs(x - prev_x) <= config.MAX_BOUNDARY_DEVIATION:
+            cleaned[i] = (x, y)
+            prev_x = x
+
+    # Upward expansion
+    prev_x = mid_x
+    for i in range(mid - 1, -1, -1):
+        x, y = boundary[i]
+        if abs(x - prev_x) <= config.MAX_BOUNDARY_DEVIATION:
+            cleaned[i] = (x, y)
+            prev_x = x
+
+    # Filter None slots
+    return np.array([p for p in cleaned if p is not None], dtype=np.int32)
+
+
+def _walk_keep(xs: np.ndarray, start_x: int, max_dev: int) -> np.ndarray:
+    """
+    Mask of points kept when walking xs in order, each compared to the last
+    kept x. Runs of small steps are taken whole, so the Python loop only
+    runs once per outlier gap instead of once per point.
+    """
+    n = len(xs)
+    keep = np.zeros(n, dtype=bool)
+    steps_ok = np.abs(np.diff(xs)) <= max_dev
+
+    i = 0
+    prev = start_x
+    while i < n:
+        # Next point close enough to the last kept one
+        ok = np.abs(xs[i:] - prev) <= max_dev
+        j = i + int(ok.argmax())
+        if not ok[j - i]:
+            break
+
+        # Take the run of small consecutive steps after it
+        bad = ~steps_ok[j:]
+        end = j + 1 + (int(bad.argmax()) if bad.any() else len(bad))
+        keep[j:end] = True
+
+        prev = xs[end - 1]
+        i = end
+
+    return keep
+
+
+def safety_limit_array(boundary) -> np.ndarray:
+    if boundary is None or len(boundary) == 0:
+        return _EMPTY
+
+    boundary = np.asarray(boundary, dtype=np.int32)
+    boundary = boundary[np.argsort(boundary[:, 1], kind="stable")]
+    xs = boundary[:, 0]
+
+    n = len(boundary)
+    mid = n // 2
+    max_dev = config.MAX_BOUNDARY_DEVIATION
+
+    keep = np.zeros(n, dtype=bool)
+    keep[mid] = True
+    keep[mid + 1:] = _walk_keep(xs[mid + 1:], xs[mid], max_dev)
+    keep[:mid] = _walk_keep(xs[:mid][::-1], xs[mid], max_dev)[::-1]
+
+    return boundary[keep]
+
+
+# ----------------------------------------------------------
+# Benchmark + automatic selection
+# ----------------------------------------------------------
+def make_boundary(n: int, rng: np.random.Generator, outlier_rate: float = 0.05) -> np.ndarray:
+    """
+    Synthetic boundary like the ones from find_boundries: one point per row,
+    slanted line with pixel noise and some jumps from other clusters.
+    """
+    ys = np.arange(n, dtype=np.int32)
+    slope = rng.uniform(-1.0, 1.0)
+    xs = 150 + slope * ys + rng.integers(-2, 3, n)
+    jumps = rng.random(n) < outlier_rate
+    xs[jumps] += rng.integers(30, 120, int(jumps.sum()))
+    return np.column_stack((xs.astype(np.int32), ys))
+
+
+def _time_call(fn, inputs, repeats: int) -> float:
+    """
+    Best-of-repeats mean time per call in microseconds.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for pts in inputs:
+            fn(pts)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(inputs) * 1e6
+
+
+def benchmark(lengths=BENCH_LENGTHS, samples: int = 20, repeats: int = 3, seed: int = 0) -> dict:
+    """
+    Time list vs array implementations for each boundary length.
+    Returns {check: [(length, list_us, array_us), ...]}.
+    """
+    rng = np.random.default_rng(seed)
+    pairs = {
+        "lane_like": (is_lane_like_list, is_lane_like_array),
+        "safety_limit": (safety_limit_list, safety_limit_array),
+    }
+
+    results = {name: [] for name in pairs}
+    for n in lengths:
+        inputs = [make_boundary(n, rng) for _ in range(samples)]
+        for name, (fn_list, fn_array) in pairs.items():
+            t_list = _time_call(fn_list, inputs, repeats)
+            t_array = _time_call(fn_array, inputs, repeats)
+            results[name].append((n, t_list, t_array))
+
+    return results
+
+
+def crossover(rows) -> int:
+    """
+    Smallest length from which the array version stays faster.
+    """
+    cross = None
+    for n, t_list, t_array in reversed(rows):
+        if t_array >= t_list:
+            break
+        cross = n
+    return cross if cross is not None else np.iinfo(np.int32).max
+
+
+# Used until calibrate() has run (desktop measurement, see __main__)
+DEFAULT_CROSSOVER = {"lane_like": 100, "safety_limit": 300}
+
+_crossover = None
+
+def calibrate(samples: int = 20, repeats: int = 3) -> dict:
+    """
+    Measure the list/array crossover on this machine for "auto" mode.
+    Takes tens of ms, call it once at startup before the frame loop (it
+    never runs inside a frame). Returns {check: crossover length}.
+    """
+    global _crossover
+    results = benchmark(samples=samples, repeats=repeats)
+    _crossover = {name: crossover(rows) for name, rows in results.items()}
+    return _crossover
+
+
+def _use_array(check: str, n: int) -> bool:
+    mode = config.BOUNDARY_VALIDATION
+    if mode == "array":
+        return True
+    if mode == "list":
+        return False
+    return n >= (_crossover or DEFAULT_CROSSOVER)[check]
+
+
+def is_lane_like(pts) -> bool:
+    if _use_array("lane_like", len(pts)):
+        return is_lane_like_array(pts)
+    return is_lane_like_list(pts)
+
+
+def centered_safety_limit(boundary) -> np.ndarray:
+    """
+    Walk outward from the middle point and drop points that jump more than
+    MAX_BOUNDARY_DEVIATION from the last kept one. Result is sorted by y.
+    """
+    if boundary is None or len(boundary) == 0:
+        return _EMPTY
+    if _use_array("safety_limit", len(boundary)):
+        return safety_limit_array(boundary)
+    return safety_limit_list(boundary)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List vs array boundary validation")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    results = benchmark(samples=args.samples, repeats=args.repeats)
+    for name, rows in results.items():
+        print(f"{name}:")
+        print(f"  {'len':>5} {'list us':>10} {'array us':>10}")
+        for n, t_list, t_array in rows:
+            print(f"  {n:>5} {t_list:>10.1f} {t_array:>10.1f}")
+        cross = crossover(rows)
+        if cross > max(BENCH_LENGTHS):
+            print("  crossover: list always faster")
+        else:
+            print(f"  crossover: array faster from {cross} points")
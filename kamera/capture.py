@@ -0,0 +1,76 @@
+"""
+Camera capture with a grayscale fast path.
+
+With config.CAPTURE_FORMAT = "YUV420" the camera delivers planar YUV420.
+The vision pipeline only needs luminance, so it gets the Y plane as a view
+of the captured buffer (no copy, no cvtColor). The BGR image is only
+converted when something asks for it (visualization/streaming), at most
+once per frame. "RGB888" keeps the old full-color capture.
+
+Works with anything shaped like Picamera2, e.g. fake_picamera2.FakePicamera2
+when testing off the Pi.
+"""
+import time
+from typing import Optional, Tuple
+import cv2
+import numpy as np
+import config
+
+
+class CapturedFrame:
+    """
+    One captured frame. gray: (h, w) view of the Y plane. bgr(): color
+    image, converted on first call and cached.
+    """
+
+    def __init__(self, data: np.ndarray, size: Tuple[int, int], fmt: str):
+        self.data = data
+        self.width, self.height = size
+        self.format = fmt
+        self._bgr: Optional[np.ndarray] = None
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return (self.height, self.width, 3)
+
+    @property
+    def gray(self) -> np.ndarray:
+        if self.format == "YUV420":
+            return self.data[:self.height, :self.width]
+        return cv2.cvtColor(self.data, cv2.COLOR_BGR2GRAY)
+
+    def bgr(self) -> np.ndarray:
+        if self._bgr is None:
+            if self.format == "YUV420":
+                # Convert with the row padding (stride) still in place, crop after
+                self._bgr = cv2.cvtColor(self.data, cv2.COLOR_YUV2BGR_I420)[:, :self.width]
+            else:
+                self._bgr = self.data
+        return self._bgr
+
+    @property
+    def vision_input(self) -> np.ndarray:
+        """ What process_frame should get: Y plane view or the color frame. """
+        return self.gray if self.format == "YUV420" else self.data
+
+
+def configure(picam2, fmt: str = None) -> None:
+    fmt = fmt or config.CAPTURE_FORMAT
+    cam_cfg = picam2.create_preview_configuration(
+        main={"format": fmt, "size": (config.FRAME_W, config.FRAME_H)}
+    )
+    picam2.configure(cam_cfg)
+
+
+def capture(picam2, fmt: str = None) -> Tuple[CapturedFrame, int]:
+    """
+    Returns (frame, sensor timestamp in ns on the monotonic clock).
+    """
+    fmt = fmt or config.CAPTURE_FORMAT
+    request = picam2.capture_request()
+    try:
+        data = request.make_array("main")
+        ts = request.get_metadata().get("SensorTimestamp", time.monotonic_ns())
+    finally:
+        request.release()
+    return CapturedFrame(data, (config.FRAME_W, config.FRAME_H), fmt), ts
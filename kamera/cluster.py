@@ -1,9 +1,11 @@
-from dataclasses import dataclass
-from typing import Tuple, Literal
+import weakref
+from dataclasses import dataclass, field
+from typing import List, Tuple, Literal
 from enum import Enum
 import numpy as np
 import cv2
 import config
+from pipeline_context import ClusterBuffers
 
 
 class ClusterType(Enum):
@@ -14,8 +16,17 @@ class ClusterType(Enum):
     OK = 4
 
 
+# Flatter bounding boxes (height / width) are never lane lines
+MIN_ASPECT = 0.25
+
+
 @dataclass
 class Cluster:
+    """
+    Bbox/area come straight from the component stats. The per-row
+    geometry (row_widths, row_left, row_right, row_center) is built on
+    first access, see ClusterGeometry.
+    """
     id: int
     slice: Tuple[slice, slice]
     center_coords: Tuple[int, int]
@@ -24,109 +35,448 @@ class Cluster:
     bbox_area: int
     ctype: ClusterType = ClusterType.OK
 
-    # Pre-computed properties
-    row_widths: np.ndarray[np.int32] | None = None
-    row_left:   np.ndarray[np.int32] | None = None
-    row_right:  np.ndarray[np.int32] | None = None
-    row_center: np.ndarray[np.int32] | None = None
+    # (row_widths, row_left, row_right, row_center) once built
+    rows: Tuple[np.ndarray, ...] | None = field(default=None, repr=False, compare=False)
+    geometry: "ClusterGeometry | None" = field(default=None, repr=False, compare=False)
+
+    def _row_data(self, i: int) -> np.ndarray:
+        if self.rows is None:
+            self.geometry.build(self)
+        return self.rows[i]
+
+    @property
+    def row_widths(self) -> np.ndarray:
+        return self._row_data(0)
+
+    @property
+    def row_left(self) -> np.ndarray:
+        return self._row_data(1)
+
+    @property
+    def row_right(self) -> np.ndarray:
+        return self._row_data(2)
+
+    @property
+    def row_center(self) -> np.ndarray:
+        return self._row_data(3)
+
+@dataclass
+class ClusterRuns:
+    """
+    Run-length encoded clusters: one entry per horizontal run of pixels,
+    x_end exclusive. Runs are sorted by cluster id, then row, then x, so
+    the runs of cluster k are runs[offsets[k-1]:offsets[k]].
+    """
+    row:        np.ndarray
+    x_start:    np.ndarray
+    x_end:      np.ndarray
+    cluster_id: np.ndarray
+    offsets:    np.ndarray
+    shape:      Tuple[int, int]
+
+    @classmethod
+    def empty(cls, shape: Tuple[int, int]) -> "ClusterRuns":
+        e = np.empty(0, dtype=np.int32)
+        return cls(e, e, e, e, np.zeros(1, dtype=np.intp), tuple(shape))
+
+    @classmethod
+    def from_labels(cls,
+                    mask: np.ndarray,
+                    labeled: np.ndarray,
+                    lut: np.ndarray,
+                    edges: np.ndarray | None = None) -> "ClusterRuns":
+        """
+        Encode the runs of a 0/1 mask, with the cluster id taken from
+        lut[labeled] at each run start. Runs with id 0 are dropped.
+        """
+        h, w = mask.shape
+        if edges is None:
+            edges = np.empty((h, w + 1), dtype=bool)
+
+        # Value changes with a virtual 0 column on both sides,
+        # so every row has start/end edges in pairs
+        np.not_equal(mask[:, :1], 0, out=edges[:, :1])
+        np.not_equal(mask[:, 1:], mask[:, :-1], out=edges[:, 1:w])
+        np.not_equal(mask[:, -1:], 0, out=edges[:, w:])
+
+        r, c = np.nonzero(edges)
+        rows = r[0::2].astype(np.int32)
+        x_start = c[0::2].astype(np.int32)
+        x_end = c[1::2].astype(np.int32)
+
+        ids = lut[labeled[rows, x_start]]
+        order = np.argsort(ids, kind="stable")
+        order = order[ids[order] > 0]
+
+        ids = ids[order]
+        n_clusters = int(lut.max()) if lut.size else 0
+        offsets = np.searchsorted(ids, np.arange(1, n_clusters + 2))
+
+        return cls(rows[order], x_start[order], x_end[order], ids, offsets, (h, w))
+
+    def relabel(self, lut: np.ndarray) -> "ClusterRuns":
+        """
+        Runs with ids mapped through lut, runs mapped to 0 dropped. lut
+        must keep the id order (as find_clusters' survivor lut does).
+        """
+        ids = lut[self.cluster_id]
+        sel = ids > 0
+        ids = ids[sel]
+        n_clusters = int(lut.max()) if lut.size else 0
+        offsets = np.searchsorted(ids, np.arange(1, n_clusters + 2))
+        return ClusterRuns(self.row[sel], self.x_start[sel], self.x_end[sel], ids, offsets, self.shape)
+
+    def cluster_slice(self, cluster_id: int) -> slice:
+        return slice(self.offsets[cluster_id - 1], self.offsets[cluster_id])
+
+    def in_box(self, y0: int, y1: int, x0: int, x1: int):
+        """
+        Runs of all clusters inside the box, clipped to it: (row, x_start, x_end).
+        """
+        xs = np.maximum(self.x_start, x0)
+        xe = np.minimum(self.x_end, x1)
+        sel = (self.row >= y0) & (self.row < y1) & (xe > xs)
+        return self.row[sel], xs[sel], xe[sel]
+
+    def to_label_image(self, out: np.ndarray | None = None) -> np.ndarray:
+        """
+        Full-size int32 label image, only meant for visualization/debugging.
+        """
+        if out is None:
+            out = np.zeros(self.shape, dtype=np.int32)
+        else:
+            out.fill(0)
+
+        lengths = self.x_end - self.x_start
+        if lengths.size == 0:
+            return out
+
+        run_idx = np.repeat(np.arange(lengths.size), lengths)
+        first = np.cumsum(lengths) - lengths
+        xs = self.x_start[run_idx] + (np.arange(run_idx.size) - first[run_idx])
+        out[self.row[run_idx], xs] = self.cluster_id[run_idx]
+        return out
+
+
+def compute_row_geometry(runs: ClusterRuns,
+                         ids: np.ndarray,
+                         xs: np.ndarray,
+                         ys: np.ndarray,
+                         hs: np.ndarray):
+    """
+    Per-row widths and left/right/center (bbox-local x, -1 for empty rows)
+    for many clusters at once, straight from their runs.
+
+    Runs of one (cluster, row) are consecutive and sorted by x, so left/right
+    come from the first/last run of each group and widths/x-sums from bincount.
+    Returns a list of (row_widths, row_left, row_right, row_center) per cluster.
+    """
+    ids = np.asarray(ids, dtype=np.intp)
+    hs = np.asarray(hs, dtype=np.intp)
+    n_rows = int(hs.sum())
+
+    # Gather the runs of the requested clusters
+    starts = runs.offsets[ids - 1]
+    counts = runs.offsets[ids] - starts
+    owner = np.repeat(np.arange(ids.size), counts)
+    idx = starts[owner] + (np.arange(owner.size) - (np.cumsum(counts) - counts)[owner])
+
+    x0 = np.asarray(xs, dtype=np.intp)[owner]
+    x_start = runs.x_start[idx] - x0
+    x_end = runs.x_end[idx] - x0
+    lengths = x_end - x_start
+
+    # Position in the stacked rows of all clusters
+    row_starts = np.cumsum(hs) - hs
+    pos = row_starts[owner] + runs.row[idx] - np.asarray(ys, dtype=np.intp)[owner]
+
+    widths = np.bincount(pos, weights=lengths, minlength=n_rows).astype(np.int32)
+    x_sum = np.bincount(pos, weights=(x_start + x_end - 1) * lengths // 2, minlength=n_rows)
+
+    left = np.full(n_rows, -1, dtype=np.int32)
+    right = np.full(n_rows, -1, dtype=np.int32)
+    if pos.size:
+        new_group = np.empty(pos.size, dtype=bool)
+        new_group[0] = True
+        np.not_equal(pos[1:], pos[:-1], out=new_group[1:])
+        last = np.roll(new_group, -1)
+
+        left[pos[new_group]] = x_start[new_group]
+        right[pos[last]] = x_end[last] - 1
+
+    has = widths > 0
+    center = np.where(has, x_sum // np.maximum(widths, 1), -1).astype(np.int32)
 
-def find_clusters(binary):
+    bounds = row_starts[1:]
+    return list(zip(np.split(widths, bounds), np.split(left, bounds),
+                    np.split(right, bounds), np.split(center, bounds)))
+
+
+def _merge_intervals(group: np.ndarray, x_start: np.ndarray, x_end: np.ndarray, width: int):
+    """
+    Union of overlapping or touching [x_start, x_end) intervals within each
+    group. Input sorted by group, then x_start. Returns (first index of each
+    merged interval, merged x_end).
+    """
+    if group.size == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.int32)
+
+    new_group = np.empty(group.size, dtype=bool)
+    new_group[0] = True
+    np.not_equal(group[1:], group[:-1], out=new_group[1:])
+
+    # Running max of x_end restarted per group: lift each group above the last
+    lift = np.cumsum(new_group).astype(np.int64) * (width + 1)
+    reach = np.maximum.accumulate(x_end + lift) - lift
+
+    start = new_group.copy()
+    start[1:] |= x_start[1:] > reach[:-1]
+    first = np.flatnonzero(start)
+    return first, np.maximum.reduceat(x_end, first).astype(np.int32)
+
+
+def _union_find(n: int, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Root (smallest member) of every node 0..n-1 after joining the pairs
+    (a[i], b[i]). Union-find done for all pairs at once: hook both roots
+    of every pair to the smaller one, compress paths, repeat until all
+    pairs share a root.
+    """
+    parent = np.arange(n, dtype=np.intp)
+    while True:
+        ra, rb = parent[a], parent[b]
+        differ = ra != rb
+        if not differ.any():
+            return parent
+        lo = np.minimum(ra[differ], rb[differ])
+        np.minimum.at(parent, ra[differ], lo)
+        np.minimum.at(parent, rb[differ], lo)
+
+        # Path compression down to the roots
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+
+def gap_merge_components(mask: np.ndarray, radius: int, buffers: ClusterBuffers):
+    """
+    Same clusters as dilating mask by `radius` iterations of a 3x3 kernel
+    and labeling the result, without dilating the image.
+
+    Labels the undilated mask, grows each component's runs by radius
+    (pixels closer than 2 * radius + 1 end up touching), joins touching
+    components with union-find and encodes the grown runs per cluster.
+    Returns (stats, centroids, runs) like connectedComponentsWithStats,
+    with runs holding every cluster (ids = labels).
+    """
+    h, w = mask.shape
+    num, labeled = cv2.connectedComponents(mask, labels=buffers.labels,
+                                           connectivity=8, ltype=cv2.CV_32S)
+    lut = np.arange(num, dtype=np.int32)
+    raw = ClusterRuns.from_labels(mask, labeled, lut, buffers.edges)
+
+    # Grow every run by radius in x, copy it to the rows within radius
+    dy = np.arange(-radius, radius + 1, dtype=np.int32)
+    rows = (raw.row[:, None] + dy).ravel()
+    inside = (rows >= 0) & (rows < h)
+    rows = rows[inside]
+    x_start = np.repeat(np.maximum(raw.x_start - radius, 0), dy.size)[inside]
+    x_end = np.repeat(np.minimum(raw.x_end + radius, w), dy.size)[inside]
+    comp = np.repeat(raw.cluster_id, dy.size)[inside]
+
+    # Touching runs in a band of two rows (same row or 8-neighbours in the
+    # next) are connected. A row is in band y - 1 and band y.
+    band = np.concatenate((rows - 1, rows))
+    b_start = np.concatenate((x_start, x_start))
+    b_end = np.concatenate((x_end, x_end))
+    b_comp = np.concatenate((comp, comp))
+    order = np.lexsort((b_start, band))
+    first, _ = _merge_intervals(band[order], b_start[order], b_end[order], w)
+    seg = np.repeat(first, np.diff(np.append(first, order.size)))
+    a, b = b_comp[order[seg]], b_comp[order]
+    pairs = np.unique(a[a != b].astype(np.int64) * num + b[a != b])
+
+    roots = _union_find(num, pairs // num, pairs % num)
+
+    # Cluster ids in the order the labeling scan meets them (2x2 blocks,
+    # row-major), so ids match connectedComponents on the dilated image
+    scan_pos = (rows // 2).astype(np.int64) * (w // 2 + 1) + x_start // 2
+    first_seen = np.full(num, np.iinfo(np.int64).max)
+    np.minimum.at(first_seen, roots[comp], scan_pos)
+    cluster_roots = np.flatnonzero(first_seen < np.iinfo(np.int64).max)
+    cluster_roots = cluster_roots[np.argsort(first_seen[cluster_roots], kind="stable")]
+    ids = np.zeros(num, dtype=np.int32)
+    ids[cluster_roots] = np.arange(1, cluster_roots.size + 1, dtype=np.int32)
+
+    # Union of the grown runs per (cluster, row)
+    cid = ids[roots[comp]]
+    order = np.lexsort((x_start, rows, cid))
+    cid, rows, x_start = cid[order], rows[order], x_start[order]
+    first, x_end = _merge_intervals(cid.astype(np.int64) * h + rows, x_start, x_end[order], w)
+    cid, rows, x_start = cid[first], rows[first], x_start[first]
+
+    n = cluster_roots.size + 1
+    offsets = np.searchsorted(cid, np.arange(1, n + 1))
+    runs = ClusterRuns(rows, x_start, x_end, cid, offsets, (h, w))
+
+    # Stats and centroids from the runs
+    lengths = (x_end - x_start).astype(np.int64)
+    area = np.bincount(cid, weights=lengths, minlength=n)
+    x_sum = np.bincount(cid, weights=(x_start + x_end - 1) * lengths // 2, minlength=n)
+    y_sum = np.bincount(cid, weights=rows * lengths, minlength=n)
+
+    stats = np.zeros((n, 5), dtype=np.int32)
+    stats[0] = (0, 0, w, h, h * w - int(area.sum()))
+    starts = offsets[:-1]
+    if cid.size:
+        left = np.minimum.reduceat(x_start, starts)
+        right = np.maximum.reduceat(x_end, starts)
+        top = rows[starts]
+        bottom = rows[offsets[1:] - 1] + 1
+        stats[1:, cv2.CC_STAT_LEFT] = left
+        stats[1:, cv2.CC_STAT_TOP] = top
+        stats[1:, cv2.CC_STAT_WIDTH] = right - left
+        stats[1:, cv2.CC_STAT_HEIGHT] = bottom - top
+        stats[1:, cv2.CC_STAT_AREA] = area[1:]
+
+    centroids = np.zeros((n, 2), dtype=np.float64)
+    centroids[1:, 0] = x_sum[1:] / np.maximum(area[1:], 1)
+    centroids[1:, 1] = y_sum[1:] / np.maximum(area[1:], 1)
+    return stats, centroids, runs
+
+
+class ClusterGeometry:
+    """
+    Lazy per-row geometry for the clusters of one frame.
+
+    Nothing is computed until a cluster's row data is first asked for.
+    Then one compute_row_geometry batch covers that cluster and every other
+    pending cluster not marked IGNORE by then, so junk components that
+    only fail the cheap stats filters never get row geometry.
+    """
+
+    def __init__(self, runs: ClusterRuns, clusters: List[Cluster]):
+        self.runs = runs
+        # Weak, so clusters <-> geometry is no reference cycle and a frame's
+        # clusters are freed right away instead of by the cyclic GC
+        self.pending = [weakref.ref(c) for c in clusters]
+
+    def build(self, cluster: Cluster) -> None:
+        alive = [c for c in (ref() for ref in self.pending) if c is not None]
+        batch = [c for c in alive
+                 if c is cluster or c.ctype != ClusterType.IGNORE]
+        geometry = compute_row_geometry(
+            self.runs,
+            ids=[c.id for c in batch],
+            xs=[c.bbox[2] for c in batch],
+            ys=[c.bbox[0] for c in batch],
+            hs=[c.bbox[1] - c.bbox[0] for c in batch],
+        )
+        for c, rows in zip(batch, geometry):
+            c.rows = rows
+        self.pending = [weakref.ref(c) for c in alive if c.rows is None]
+
+
+def find_clusters(binary, buffers: ClusterBuffers | None = None):
     """
     High-performance implementation using OpenCV:
         1) Dilation via cv2.dilate (NEON-optimized on ARM)
         2) Connected components via cv2.connectedComponentsWithStats
-        3) Extract bbox, centroid, area directly from stats
-        4) Precompute per-row widths and left/right/center indices
+           (config.CLUSTER_BACKEND = "union_find": gap_merge_components
+           replaces 1-2 and returns the same stats and runs)
+        3) Stats-only filters for all labels at once: area drops the
+           component, a flat bbox (MIN_ASPECT) marks it IGNORE
+        4) Run-length encode survivors (ClusterRuns), no full label image
+        5) Build clusters from stats, per-row geometry is lazy (ClusterGeometry)
+
+    If buffers is given all images are written into it instead of allocating.
+    Returns (runs, clusters), use runs.to_label_image() for a label image.
     """
 
     binary = np.asarray(binary)
     if binary.ndim != 2:
         raise ValueError("binary must be a 2D array")
 
-    # Create binary mask (0/1)
-    mask = (binary > 0).astype(np.uint8)
+    if buffers is None or buffers.shape != binary.shape:
+        buffers = ClusterBuffers(binary.shape)
 
-    # ----------------------------------------------------------
-    # 1) Dilation
-    # ----------------------------------------------------------
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-    dilated = cv2.dilate(mask, kernel, iterations=config.DILATION_ITER_COUNT)
+    # Create binary mask (0/1)
+    mask = cv2.threshold(binary, 0, 1, cv2.THRESH_BINARY, dst=buffers.mask)[1]
 
     # ----------------------------------------------------------
-    # 2) Connected components
+    # 1-2) Dilation + connected components, or the gap-merging
+    #      backend that gives the same clusters without dilating
     # ----------------------------------------------------------
-    num_labels, labeled, stats, centroids = cv2.connectedComponentsWithStats(
-        dilated, connectivity=8
-    )
+    merged_runs = None
+    if config.CLUSTER_BACKEND == "union_find":
+        stats, centroids, merged_runs = gap_merge_components(
+            mask, config.DILATION_ITER_COUNT, buffers)
+        num_labels = len(stats)
+    else:
+        dilated = cv2.dilate(mask, buffers.dilate_kernel, dst=buffers.dilated,
+                             iterations=config.DILATION_ITER_COUNT)
+        num_labels, labeled, stats, centroids = cv2.connectedComponentsWithStats(
+            dilated, labels=buffers.labels, connectivity=8, ltype=cv2.CV_32S
+        )
 
     if num_labels <= 1:
-        return np.zeros_like(labeled, np.int32), []
+        return ClusterRuns.empty(binary.shape), []
 
     # ----------------------------------------------------------
-    # 3) Build clusters
+    # 3) Stats-only filters
     # ----------------------------------------------------------
-    final_labeled = np.zeros_like(labeled, dtype=np.int32)
-    clusters = []
-    next_id = 1
+    keep = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= config.MIN_CLUSTER_ACTIVE_PX) + 1
+    kept_stats = stats[keep]
+    flat = (kept_stats[:, cv2.CC_STAT_HEIGHT]
+            < MIN_ASPECT * np.maximum(kept_stats[:, cv2.CC_STAT_WIDTH], 1))
 
-    for lbl in range(1, num_labels):
-        x, y, w, h, area = stats[lbl]
-
-        if area < config.MIN_CLUSTER_ACTIVE_PX:
-            continue
+    # ----------------------------------------------------------
+    # 4) Run-length encode surviving components
+    # ----------------------------------------------------------
 
-        y_slice = slice(y, y + h)
-        x_slice = slice(x, x + w)
+    lut = np.zeros(num_labels, dtype=np.int32)
+    lut[keep] = np.arange(1, keep.size + 1, dtype=np.int32)
+    if merged_runs is not None:
+        runs = merged_runs.relabel(lut)
+    else:
+        runs = ClusterRuns.from_labels(dilated, labeled, lut, buffers.edges)
 
-        # Set cluster ID in final labeled image
-        final_labeled[labeled == lbl] = next_id
+    if keep.size == 0:
+        return runs, []
 
+    # ----------------------------------------------------------
+    # 5) Build clusters, geometry on demand
+    # ----------------------------------------------------------
+    clusters = []
+    for i, lbl in enumerate(keep):
+        x, y, w, h, area = kept_stats[i]
         cx, cy = centroids[lbl]
 
-        # ------------------------------------------------------
-        # Precompute per-row geometry
-        # ------------------------------------------------------
-        local = (labeled[y_slice, x_slice] == lbl)
-
-        row_widths = np.sum(local, axis=1).astype(np.int32)
-
-        # Prepare arrays of same length as number of rows
-        row_left   = np.full(h, -1, dtype=np.int32)
-        row_right  = np.full(h, -1, dtype=np.int32)
-        row_center = np.full(h, -1, dtype=np.int32)
-
-        # Compute left/right/center for each row
-        for r in range(h):
-            xs = np.where(local[r])[0]
-            if xs.size > 0:
-                row_left[r]   = xs[0]
-                row_right[r]  = xs[-1]
-                row_center[r] = int(xs.mean())
-
         clusters.append(
             Cluster(
-                id=next_id,
-                slice=(y_slice, x_slice),
+                id=i + 1,
+                slice=(slice(y, y + h), slice(x, x + w)),
                 center_coords=(int(cx), int(cy)),
                 bbox=(y, y + h, x, x + w),
                 pixel_count=int(area),
                 bbox_area=w * h,
-                row_widths=row_widths,
-                row_left=row_left,
-                row_right=row_right,
-                row_center=row_center
+                ctype=ClusterType.IGNORE if flat[i] else ClusterType.OK,
             )
         )
 
-        next_id += 1
+    geometry = ClusterGeometry(runs, clusters)
+    for c in clusters:
+        c.geometry = geometry
 
-    return final_labeled, clusters
+    return runs, clusters
 
 
 
 Method = Literal["left", "right", "center"]
 
-def get_cluster_points(binary_labeled: np.ndarray, 
+def get_cluster_points(runs: ClusterRuns,
                        cluster: Cluster,
                        method: Method) -> np.ndarray:
 
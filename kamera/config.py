@@ -1,3 +1,4 @@
+import os
 import cv2
 
 # Image
@@ -5,6 +6,7 @@ FRAME_W, FRAME_H = 480, 360
 FOCAL_LENGTH_PIX = 470
 CAMERA_X_OFFSET = -20
 BLACK_THRESHOLD = 120
+CAPTURE_FORMAT = "YUV420"                       # "YUV420" (Y plane to vision, color on demand) or "RGB888"
 
 # ROI (Region of interest) 
 ROI_TOP_SCALE = 0.9
@@ -15,6 +17,7 @@ HORIZONTAL_MARGIN = 0.01
 # Cluster config
 MIN_CLUSTER_ACTIVE_PX = 50
 DILATION_ITER_COUNT = 2                         # Good against noise but heavy
+CLUSTER_BACKEND = "dilate"                      # "dilate" or "union_find" (same clusters, no ROI dilation)
 
 # Line config                                   (Thresholds to be considered tape)
 MIN_LINE_WIDTH_PX = 4
@@ -32,6 +35,22 @@ SCANLINES = 6
 DEFAULT_LANE_WIDTH_OF_ROI = 0.75
 LANE_WIDTH_DECREASE_RATE = 0.06
 MAX_BOUNDARY_DEVIATION = 12                     # Max allowed point-to-point deviation
+BOUNDARY_VALIDATION = "auto"                    # "auto" (calibrated at startup), "array" or "list"
+
+# Lane tracking                                 (Narrow band search around Kalman-tracked lines)
+LANE_TRACKING = True
+TRACK_MIN_FRAMES = 5                            # Full frames with both edges before tracking
+TRACK_REFRESH_FRAMES = 10                       # Run the full pipeline at least this often
+TRACK_BAND_PX = 20                              # Half width of the search band
+TRACK_MIN_ROW_COVERAGE = 0.4                    # Share of ROI rows that must hit a band
+TRACK_MAX_OUTSIDE_PX = 300                      # White px outside both bands before full search
+TRACK_PROCESS_NOISE_PX = 4.0                    # Expected coefficient drift per frame
+TRACK_MEASUREMENT_NOISE_PX = 3.0
+TRACK_GATE_PX = 30                              # Max jump from prediction before reset
+
+# Detector                                      (Default for process_frame, can be set per frame)
+DETECTOR = "full"                               # "full", "scanline" or "auto" (scanline, full if suspect)
+SCANLINE_ROWS_PER_BAND = 4                      # Sampled rows per scanline band
 
 # Target path
 LOOKAHEAD_POS = 0.5                             # How far into ROI to compute heading
@@ -61,7 +80,26 @@ SHOW_CLUSTERS_TEXT = []                         # ClusterTypes (0...3)
 
 # Other
 PERFORMANCE_LOGGING = True
-TIME_LOGGING = False
+PROFILING = False                               # Stage profiler (profiler.py), report with the FPS print
+PROFILE_RING_SIZE = 4096                        # Stage samples kept
+PROFILE_FRAME_BUDGET_MS = 33                    # Frames slower than this are flagged
+
+# Black box recorder                            (blackbox.py, freeze with stop command, SIGUSR1 or anomaly)
+BLACKBOX = True
+BLACKBOX_PATH = "/dev/shm/kamera_blackbox.bbx"  # Ring file, tmpfs to spare the SD card
+BLACKBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")  # Frozen datasets end up here
+BLACKBOX_CAPACITY = 600                         # Frames in the ring (20 s at 30 fps)
+BLACKBOX_ROI_ONLY = True                        # Store only the ROI pixels
+BLACKBOX_FREEZE_SECONDS = 10
+BLACKBOX_FREEZE_COOLDOWN = 5.0                  # Min seconds between two freezes
+BLACKBOX_LOST_EDGES_FRAMES = 15                 # Anomaly: no lane edge at all for this many frames
 
 # TCP
-PORT = 6000
\ No newline at end of file
+PORT = 6000
+STREAM_FPS = 10                                 # Max rate of visualized frames, 0 = every frame
+STREAM_TARGET_LATENCY_MS = 150                  # Adaptive JPEG quality/scale aims for this
+OVERLAY_PORT = 6001                             # Overlay geometry side channel
+STREAM_OVERLAY = "burned"                       # "burned", "vector" (GUI draws) or "geometry" (no JPEG)
+
+# Pipeline threads                               (CPU core per stage, None = no pinning)
+STAGE_CORES = {"capture": None, "vision": None, "encode": None, "stream": None}
\ No newline at end of file
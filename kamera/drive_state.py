@@ -0,0 +1,138 @@
+"""
+Route/intersection/stop line state machine, fed one FrameResult per frame.
+
+Used by picam.main on the car and by replay_benchmark.py offline, so it
+has no sockets or camera: the caller feeds routes in and acts on the
+returned stop commands and headings.
+"""
+from collections import deque
+from enum import Enum
+from typing import List, Optional
+import config
+from process_frame import Detector, Direction, FrameResult
+
+
+class Action(Enum):
+    LEFT = 'V'
+    RIGHT = 'H'
+    STOP_NA = 'S'
+    STOP = 'B'
+
+
+class Poll(Enum):
+    DRIVE = 0       # Process the frame
+    WAIT = 1        # No route, hold heading 0
+    SKIP = 2        # Invalid route byte, drop this frame
+
+
+class DriveStateMachine:
+    def __init__(self):
+        self.vals: List[int] = []
+        self.dir = Direction.LEFT
+        self.next_action: Action = Action.STOP_NA
+        self.action_completed = True
+        self.intersection_is_active = False
+        self.stop_section_active = False
+        self.waiting_for_route = False
+        self.last_stop = False
+
+        self.intersection_cntr = deque([False] * config.BUFFER_LENGTH, maxlen=config.BUFFER_LENGTH)
+        self.stopline_cntr = deque([False] * config.BUFFER_LENGTH, maxlen=config.BUFFER_LENGTH)
+        self.normal_road_cntr = deque([False] * config.BUFFER_LENGTH, maxlen=config.BUFFER_LENGTH)
+
+    def set_route(self, vals: List[int]) -> None:
+        self.vals = list(vals)
+        print("Ny rutt: ", self.vals)
+        self.action_completed = True
+        self.last_stop = False
+
+    def poll(self) -> Poll:
+        """ Take the next route command if the current one is done. """
+        if not self.action_completed:
+            return Poll.DRIVE
+
+        if not self.vals:
+            if not self.waiting_for_route:
+                print("Inväntar ny rutt...")
+                self.waiting_for_route = True
+            return Poll.WAIT
+
+        self.waiting_for_route = False
+        cmd = self.vals.pop(0)
+        try:
+            self.next_action = Action(chr(cmd))
+        except ValueError:
+            print("Recieved invalid byte:", cmd)
+            return Poll.SKIP
+
+        print("Nästa kommando:", chr(cmd))
+        if self.next_action == Action.LEFT:
+            self.dir = Direction.LEFT
+        elif self.next_action == Action.RIGHT:
+            self.dir = Direction.RIGHT
+
+        self.action_completed = False
+        if not self.vals:
+            self.last_stop = True
+        return Poll.DRIVE
+
+    @property
+    def detector(self) -> Optional[Detector]:
+        """
+        Cheap detector (config.DETECTOR) on normal road, full pipeline
+        while an intersection or stop line is being handled.
+        """
+        if self.intersection_is_active or self.stop_section_active:
+            return Detector.FULL
+        return None
+
+    def update(self, res: FrameResult) -> Optional[bool]:
+        """
+        Advance on one processed frame. Scales res.heading inside
+        intersections. Returns is_last for send_stop() when a stop is
+        reached, otherwise None.
+        """
+        stop_cmd = None
+        self.intersection_cntr.append(res.other_path is not None)
+        self.stopline_cntr.append(res.stop_point is not None)
+
+        is_normal = res.both_edges_found and res.other_path is None
+        self.normal_road_cntr.append(is_normal)
+
+        # Check intersection
+        next_is_turn = (self.next_action == Action.LEFT or self.next_action == Action.RIGHT)
+        if (self.intersection_cntr.count(True) >= config.INTO_THRESHOLD
+                and not self.intersection_is_active and next_is_turn):
+            self.intersection_is_active = True
+            if self.dir == Direction.LEFT:
+                print("Håller till vänster i korsning...")
+            elif self.dir == Direction.RIGHT:
+                print("Håller till höger i korsning...")
+        elif self.normal_road_cntr.count(True) >= config.EXIT_THRESHOLD and self.intersection_is_active:
+            if res.median_lane_width and res.median_lane_width < 0.67:
+                self.intersection_is_active = False
+                self.action_completed = True
+                print("Ute ur korsning.")
+
+        # Check stopline
+        if (self.stopline_cntr.count(True) >= config.INTO_THRESHOLD
+                and not self.stop_section_active and not self.intersection_is_active):
+            self.stop_section_active = True
+            if self.next_action == Action.STOP and res.dist_to_stopline is not None:
+                print("Hittade hållplats")
+                stop_cmd = self.last_stop
+            else:
+                print("Passerar stopplinje...")
+
+        elif self.stopline_cntr.count(False) >= config.EXIT_THRESHOLD and self.stop_section_active:
+            self.stop_section_active = False
+            self.action_completed = True
+
+            if self.next_action == Action.STOP:
+                print("Lämnar hållplats.")
+            else:
+                print("Stoplinje passerad.")
+
+        if self.intersection_is_active:
+            res.heading *= config.INTERSECTION_HEADING_MULTIPLIER
+        return stop_cmd
@@ -0,0 +1,90 @@
+"""
+Stand-in for picamera2.Picamera2 to run the capture path off the Pi.
+
+Serves the given images (or the JPEGs next to this file) in a loop, in
+the same layout Picamera2 uses: "RGB888" as (h, w, 3) BGR, "YUV420" as
+(h * 3 // 2, stride) planar I420 with the row padding left in place.
+Only the methods picam.py/capture.py use are implemented. picam.py
+uses it only with KAMERA_FAKE_CAMERA=1 in the environment.
+"""
+import glob
+import os
+import time
+from typing import List, Optional
+import cv2
+import numpy as np
+
+STRIDE_ALIGN = 64
+
+
+class _FakeRequest:
+    def __init__(self, array: np.ndarray, timestamp: int):
+        self._array = array
+        self._metadata = {"SensorTimestamp": timestamp}
+
+    def make_array(self, name: str) -> np.ndarray:
+        return self._array.copy()
+
+    def get_metadata(self) -> dict:
+        return dict(self._metadata)
+
+    def release(self) -> None:
+        pass
+
+
+class FakePicamera2:
+    def __init__(self, images: Optional[List[np.ndarray]] = None, fps: float = 0.0):
+        if images is None:
+            here = os.path.dirname(os.path.abspath(__file__))
+            paths = sorted(glob.glob(os.path.join(here, "*.jp*g")) + glob.glob(os.path.join(here, "*.JPG")))
+            images = [cv2.imread(p) for p in paths]
+        self.images = [img for img in images if img is not None]
+        if not self.images:
+            raise ValueError("FakePicamera2 needs at least one image")
+        self.fps = fps
+        self.format = "RGB888"
+        self.size = (self.images[0].shape[1], self.images[0].shape[0])
+        self.frame_count = 0
+        self.started = False
+        self._next = 0.0
+
+    def create_preview_configuration(self, main: dict) -> dict:
+        return {"main": dict(main)}
+
+    def configure(self, cam_cfg: dict) -> None:
+        self.format = cam_cfg["main"]["format"]
+        self.size = tuple(cam_cfg["main"]["size"])
+
+    def start(self) -> None:
+        self.started = True
+
+    def stop(self) -> None:
+        self.started = False
+
+    def _make_frame(self) -> np.ndarray:
+        w, h = self.size
+        img = self.images[self.frame_count % len(self.images)]
+        if img.shape[:2] != (h, w):
+            img = cv2.resize(img, (w, h))
+
+        if self.format == "RGB888":
+            return np.ascontiguousarray(img)
+        if self.format == "YUV420":
+            stride = -(-w // STRIDE_ALIGN) * STRIDE_ALIGN
+            padded = np.zeros((h, stride, 3), dtype=np.uint8)
+            padded[:, :w] = img
+            return cv2.cvtColor(padded, cv2.COLOR_BGR2YUV_I420)
+        raise ValueError(f"FakePicamera2: unsupported format {self.format}")
+
+    def capture_request(self) -> _FakeRequest:
+        if self.fps > 0:
+            delay = self._next - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next = time.monotonic() + 1.0 / self.fps
+        req = _FakeRequest(self._make_frame(), time.monotonic_ns())
+        self.frame_count += 1
+        return req
+
+    def capture_array(self, name: str = "main") -> np.ndarray:
+        return self.capture_request().make_array(name)
@@ -1,8 +1,110 @@
 from typing import Tuple, Optional
 import numpy as np
+from dataclasses import dataclass
 import config
 import path_spacing
 
+@dataclass
+class LaneCenters:
+    """
+    Center paths for all follow modes, from one pass over the boundaries.
+    band_ys/band_widths: bands where both sides were found, with the
+    distance between the left- and right-derived centers.
+    """
+    left: Optional[np.ndarray]
+    right: Optional[np.ndarray]
+    combined: Optional[np.ndarray]
+    band_ys: np.ndarray
+    band_widths: np.ndarray
+
+
+def _band_means(boundary: np.ndarray, h: int, y_min: np.ndarray, y_max: np.ndarray) -> np.ndarray:
+    """
+    Mean x of boundary points inside each [y_min, y_max] band (NaN if none).
+    Row sums via bincount, band sums via cumulative sums, so rows shared
+    by two bands count in both.
+    """
+    if boundary.size == 0:
+        return np.full(len(y_min), np.nan)
+
+    ys = boundary[:, 1]
+    n = max(h, int(ys.max()) + 1)
+    cnt = np.zeros(n + 1)
+    tot = np.zeros(n + 1)
+    cnt[1:] = np.cumsum(np.bincount(ys, minlength=n))
+    tot[1:] = np.cumsum(np.bincount(ys, weights=boundary[:, 0], minlength=n))
+
+    band_cnt = cnt[y_max + 1] - cnt[y_min]
+    band_tot = tot[y_max + 1] - tot[y_min]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(band_cnt > 0, band_tot / band_cnt, np.nan)
+
+
+def _to_path(center_x: np.ndarray, y_center: np.ndarray) -> np.ndarray | None:
+    found = ~np.isnan(center_x)
+    if not found.any():
+        return None
+    return np.column_stack((np.round(center_x[found]), y_center[found])).astype(np.int32)
+
+
+def compute_lane_centers(
+    left_boundary: np.ndarray,
+    right_boundary: np.ndarray,
+    roi_shape: Tuple[int, int],
+) -> LaneCenters:
+    """
+    Compute lane center points for force_side "left", "right" and None
+    at once, binning both boundaries into the scanline bands a single time.
+    """
+    h, w = roi_shape
+    num_scanlines = config.SCANLINES
+
+    # Band limits, bottom band first
+    band_height = h / num_scanlines
+    i_from_bottom = np.arange(num_scanlines)
+    y_min = np.trunc(h - (i_from_bottom + 1) * band_height).astype(np.intp)
+    y_max = np.trunc(h - i_from_bottom * band_height).astype(np.intp)
+    y_min = np.maximum(0, y_min)
+    y_max = np.minimum(h - 1, y_max)
+
+    valid = y_min <= y_max
+    i_from_bottom, y_min, y_max = i_from_bottom[valid], y_min[valid], y_max[valid]
+    y_center = (0.5 * (y_min + y_max)).astype(np.int32)
+
+    x_left_avg = _band_means(left_boundary, h, y_min, y_max)
+    x_right_avg = _band_means(right_boundary, h, y_min, y_max)
+
+    # Only one boundary -> estimated lane width
+    lane_width_norm = (
+        config.DEFAULT_LANE_WIDTH_OF_ROI
+        - (config.LANE_WIDTH_DECREASE_RATE * i_from_bottom)
+    )
+    half_lane_px = lane_width_norm * w / 2.0
+
+    from_left = x_left_avg + half_lane_px
+    from_right = x_right_avg - half_lane_px
+
+    # Both visible -> true midpoint, else whichever side exists
+    combined = np.where(
+        np.isnan(x_right_avg), from_left,
+        np.where(np.isnan(x_left_avg), from_right, 0.5 * (x_left_avg + x_right_avg)),
+    )
+
+    path_l = _to_path(from_left, y_center)
+    path_r = _to_path(from_right, y_center)
+
+    both = ~np.isnan(from_left) & ~np.isnan(from_right)
+    band_widths = np.abs(np.round(from_right[both]) - np.round(from_left[both]))
+
+    return LaneCenters(
+        left=path_l,
+        right=path_r,
+        combined=_to_path(combined, y_center),
+        band_ys=y_center[both],
+        band_widths=band_widths,
+    )
+
+
 def compute_lane_center(
     left_boundary: np.ndarray,
     right_boundary: np.ndarray,
@@ -17,97 +119,37 @@ def compute_lane_center(
         "left"    -> ignore right boundary, derive center from left
         "right"   -> ignore left boundary, derive center from right
     """
-    h, w = roi_shape
-    num_scanlines = config.SCANLINES
-
-    centers = []
-
-    # ---- enforce forced side ----
+    centers = compute_lane_centers(left_boundary, right_boundary, roi_shape)
     if force_side == "left":
-        right_boundary = np.empty((0, 2), dtype=np.int32)
-    elif force_side == "right":
-        left_boundary = np.empty((0, 2), dtype=np.int32)
-
-    # Pre-extract y columns
-    left_y = left_boundary[:, 1] if left_boundary.size > 0 else None
-    right_y = right_boundary[:, 1] if right_boundary.size > 0 else None
-
-    # No boundaries at all
-    if (left_boundary.size == 0) and (right_boundary.size == 0):
-        return None
+        return centers.left
+    if force_side == "right":
+        return centers.right
+    return centers.combined
 
-    band_height = h / num_scanlines
-
-    for i in range(num_scanlines):
-        i_from_bottom = i
-
-        y_min = int(h - (i_from_bottom + 1) * band_height)
-        y_max = int(h - i_from_bottom * band_height)
-        y_min = max(0, y_min)
-        y_max = min(h - 1, y_max)
-        if y_min > y_max:
-            continue
-
-        y_center = int(0.5 * (y_min + y_max))
-
-        # --- mean LEFT in band ---
-        x_left_avg = None
-        if left_boundary.size > 0:
-            mask_l = (left_y >= y_min) & (left_y <= y_max)
-            if mask_l.any():
-                x_left_avg = float(left_boundary[mask_l, 0].mean())
-
-        # --- mean RIGHT in band ---
-        x_right_avg = None
-        if right_boundary.size > 0:
-            mask_r = (right_y >= y_min) & (right_y <= y_max)
-            if mask_r.any():
-                x_right_avg = float(right_boundary[mask_r, 0].mean())
-
-        if x_left_avg is not None and x_right_avg is not None:
-            # Both visible -> true midpoint
-            center_x = 0.5 * (x_left_avg + x_right_avg)
-
-        elif x_left_avg is not None or x_right_avg is not None:
-            # Only one boundary -> estimated lane width
-            lane_width_norm = (
-                config.DEFAULT_LANE_WIDTH_OF_ROI
-                - (config.LANE_WIDTH_DECREASE_RATE * i_from_bottom)
-            )
-            lane_width_px = lane_width_norm * w
-
-            if x_left_avg is not None:
-                center_x = x_left_avg + lane_width_px / 2.0
-            else:
-                center_x = x_right_avg - lane_width_px / 2.0
-        else:
-            continue
-
-        centers.append((int(round(center_x)), y_center))
-
-    if not centers:
-        return None
 
-    return np.array(centers, dtype=np.int32)
+def detect_diverging_paths(path_l: np.ndarray, path_r: np.ndarray, roi_shape: Tuple[int, int]) -> bool:
+    y_coords, widths = path_spacing.widths_on_common_y(path_l, path_r)
+    return diverging_from_widths(y_coords, widths, roi_shape)
 
 
-def detect_diverging_paths(path_l: np.ndarray, path_r: np.ndarray, roi_shape: Tuple[int, int]) -> bool:
+def diverging_from_widths(y_coords: np.ndarray, widths: np.ndarray, roi_shape: Tuple[int, int]) -> bool:
+    """
+    Intersection test on path spacing, e.g. LaneCenters.band_ys/band_widths.
+    """
     h, w = roi_shape
 
     h_middle = h//2
-    y_coords, widths = path_spacing.widths_on_common_y(path_l, path_r)
     if y_coords.size == 0: return False
-
     # Get average spacing in bottom 50%
-    middle_indexes = [i for i, y in enumerate(y_coords) if (y>h_middle and y < 0.8*h)]
-    if len(middle_indexes) == 0: return False
-    avg_width_middle = widths[middle_indexes].mean()
+    middle = (y_coords > h_middle) & (y_coords < 0.8*h)
+    if not middle.any(): return False
+    avg_width_middle = widths[middle].mean()
 
     # Get average spacing at top 10% of detected boundries
     y_min = np.min(y_coords)
-    top_indexes = [i for i, y in enumerate(y_coords) if abs(y-y_min)/h < 0.1]
-    if len(top_indexes) == 0: return False
-    avg_width_top = widths[top_indexes].mean()
+    top = np.abs(y_coords - y_min)/h < 0.1
+    if not top.any(): return False
+    avg_width_top = widths[top].mean()
 
     if config.DEBUG_INTERSECTION:
         print("Top:", avg_width_top)
@@ -0,0 +1,115 @@
+"""
+Versioned per-frame metadata header for the video stream.
+
+Clients opt in by sending a hello right after connecting:
+
+    b"FH" + version (u8)
+
+Clients that send nothing within HELLO_TIMEOUT get the legacy format
+([4-byte length][JPEG]), so old GUIs keep working. Version 2 payloads are
+
+    [4-byte length][header][JPEG]
+
+with the header (big-endian, timestamps in microseconds):
+
+    magic           b"FH"
+    version         u8
+    flags           u8  (unused, 0)
+    header_len      u16 (skip this many bytes to reach the JPEG)
+    seq             u32
+    capture_us      u64 sensor timestamp, Pi monotonic clock
+    vision_done_us  u64 Pi monotonic clock
+    encode_done_us  u64 Pi monotonic clock
+    sent_us         u64 Pi monotonic clock, when this client's send started
+    sent_wall_us    i64 Pi wall clock at sent_us (for the client clock offset)
+    vision_us       u32 time in process_frame
+    overlay_us      u32 time drawing the overlay (0 if none)
+    jpeg_us         u32 time in the JPEG encoder
+    capture_dropped u32 frames dropped between capture and vision
+    encode_dropped  u32 frames dropped between vision and encode
+    stream_dropped  u32 frames dropped for this client
+
+Decoder for the GUI side lives in TCP/win_gui_new2.py, keep them in sync.
+"""
+import struct
+import time
+from dataclasses import dataclass
+
+HEADER_MAGIC = b"FH"
+HEADER_VERSION = 2
+LEGACY_VERSION = 1
+HELLO_TIMEOUT = 0.5             # Seconds to wait for a client hello
+
+_HEADER = struct.Struct("!2sBBHIQQQQqIIIIII")
+HEADER_SIZE = _HEADER.size
+
+
+@dataclass
+class FrameMeta:
+    """ Timings for one frame, filled in as it moves through the stages (ns). """
+    seq: int
+    capture_ns: int
+    vision_done_ns: int = 0
+    encode_done_ns: int = 0
+    vision_ns: int = 0
+    overlay_ns: int = 0
+    jpeg_ns: int = 0
+    capture_dropped: int = 0
+    encode_dropped: int = 0
+
+
+def _us(ns: int) -> int:
+    return max(ns, 0) // 1000
+
+
+def pack_header(meta: FrameMeta, stream_dropped: int) -> bytes:
+    """
+    Header for one client. Called from the send thread right before sending.
+    """
+    sent_ns = time.monotonic_ns()
+    return _HEADER.pack(
+        HEADER_MAGIC, HEADER_VERSION, 0, HEADER_SIZE, meta.seq & 0xFFFFFFFF,
+        _us(meta.capture_ns), _us(meta.vision_done_ns), _us(meta.encode_done_ns),
+        _us(sent_ns), time.time_ns() // 1000,
+        _us(meta.vision_ns), _us(meta.overlay_ns), _us(meta.jpeg_ns),
+        meta.capture_dropped & 0xFFFFFFFF, meta.encode_dropped & 0xFFFFFFFF,
+        stream_dropped & 0xFFFFFFFF,
+    )
+
+
+def unpack_header(data: bytes) -> dict:
+    """
+    Inverse of pack_header (all times in microseconds).
+    """
+    (magic, version, _flags, header_len, seq, capture_us, vision_done_us,
+     encode_done_us, sent_us, sent_wall_us, vision_us, overlay_us, jpeg_us,
+     capture_dropped, encode_dropped, stream_dropped) = _HEADER.unpack_from(data)
+    if magic != HEADER_MAGIC or version < HEADER_VERSION:
+        raise ValueError(f"Unknown frame header {magic!r} v{version}")
+
+    return {
+        "header_len": header_len,
+        "seq": seq,
+        "capture_us": capture_us,
+        "vision_done_us": vision_done_us,
+        "encode_done_us": encode_done_us,
+        "sent_us": sent_us,
+        "sent_wall_us": sent_wall_us,
+        "vision_us": vision_us,
+        "overlay_us": overlay_us,
+        "jpeg_us": jpeg_us,
+        "capture_dropped": capture_dropped,
+        "encode_dropped": encode_dropped,
+        "stream_dropped": stream_dropped,
+    }
+
+
+def hello(version: int = HEADER_VERSION) -> bytes:
+    return HEADER_MAGIC + bytes([version])
+
+
+def parse_hello(data: bytes) -> int:
+    """ Negotiated version from a client hello, LEGACY_VERSION if invalid. """
+    if len(data) < 3 or data[:2] != HEADER_MAGIC:
+        return LEGACY_VERSION
+    return min(data[2], HEADER_VERSION)
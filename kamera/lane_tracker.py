@@ -0,0 +1,165 @@
+"""
+Temporal lane tracking.
+
+Each boundary is modeled as x = a + b*t + c*t^2, t = 0 at the bottom ROI row
+and 1 at the top, and filtered over frames with a Kalman filter (random walk
+on the coefficients, diagonal covariance so every coefficient is filtered on
+its own). Once both sides have been tracked for TRACK_MIN_FRAMES frames,
+track() finds the boundaries by sampling the binary image in a narrow band
+around each predicted line, which skips dilation, connected components and
+cluster labeling entirely.
+
+track() returns None (-> run the full pipeline) when:
+    - tracking is not confident yet or was reset
+    - a full frame is due (every TRACK_REFRESH_FRAMES, catches new clusters)
+    - too few rows hit the band on either side (lost edge)
+    - too many white pixels fall outside both bands (stop line, branching
+      lane or anything else the model does not explain)
+update() resets the tracker on stop lines, intersections and lost edges.
+"""
+from typing import Optional, Tuple
+import cv2
+import numpy as np
+import config
+import boundary_validation as bv
+
+
+class _LineFilter:
+    """ Kalman filter on the quadratic coefficients of one boundary. """
+
+    def __init__(self):
+        self.coef: Optional[np.ndarray] = None     # (a, b, c)
+        self.var: Optional[np.ndarray] = None
+
+    def reset(self) -> None:
+        self.coef = None
+        self.var = None
+
+    def predict(self) -> None:
+        if self.coef is not None:
+            self.var = self.var + config.TRACK_PROCESS_NOISE_PX ** 2
+
+    def update(self, meas: np.ndarray) -> bool:
+        """ Fuse a measured (a, b, c). False if it is too far off the prediction. """
+        r = config.TRACK_MEASUREMENT_NOISE_PX ** 2
+        if self.coef is None:
+            self.coef = meas.astype(float)
+            self.var = np.full(3, r)
+            return True
+
+        # Gate on the x difference at bottom, middle and top of the ROI
+        t = np.array([0.0, 0.5, 1.0])
+        diff = np.polyval((meas - self.coef)[::-1], t)
+        if np.abs(diff).max() > config.TRACK_GATE_PX:
+            return False
+
+        gain = self.var / (self.var + r)
+        self.coef = self.coef + gain * (meas - self.coef)
+        self.var = (1.0 - gain) * self.var
+        return True
+
+    def x_at(self, t: np.ndarray) -> np.ndarray:
+        a, b, c = self.coef
+        return a + t * (b + c * t)
+
+
+def _fit(boundary: np.ndarray, h: int) -> Optional[np.ndarray]:
+    """ Least-squares (a, b, c) of a boundary, None if it covers too few rows. """
+    if len(boundary) < config.TRACK_MIN_ROW_COVERAGE * h:
+        return None
+    t = (h - 1 - boundary[:, 1]) / max(h - 1, 1)
+    return np.polyfit(t, boundary[:, 0], 2)[::-1]
+
+
+class LaneTracker:
+    def __init__(self):
+        self.left = _LineFilter()
+        self.right = _LineFilter()
+        self.confidence = 0                 # Consecutive frames with both sides tracked
+        self.frames_since_full = 0
+
+    def reset(self) -> None:
+        self.left.reset()
+        self.right.reset()
+        self.confidence = 0
+
+    @property
+    def active(self) -> bool:
+        return self.confidence >= config.TRACK_MIN_FRAMES
+
+    def update(self, left_boundary: np.ndarray, right_boundary: np.ndarray,
+               roi_shape: Tuple[int, int], reliable: bool, tracked: bool) -> None:
+        """
+        Feed this frame's boundaries. reliable=False (stop line, intersection,
+        forced direction) drops the model so the next frames run in full.
+        """
+        self.frames_since_full = self.frames_since_full + 1 if tracked else 0
+        if not reliable:
+            self.reset()
+            return
+
+        h = roi_shape[0]
+        meas_l = _fit(left_boundary, h)
+        meas_r = _fit(right_boundary, h)
+        if meas_l is None or meas_r is None:
+            self.reset()
+            return
+
+        self.left.predict()
+        self.right.predict()
+        if not (self.left.update(meas_l) and self.right.update(meas_r)):
+            self.reset()
+            return
+        self.confidence += 1
+
+    def _sample_band(self, binary: np.ndarray, x_pred: np.ndarray, rows: np.ndarray):
+        """
+        Per-row count and x-sum of white pixels within TRACK_BAND_PX of x_pred.
+        """
+        w = binary.shape[1]
+        band = config.TRACK_BAND_PX
+        xs = np.rint(x_pred).astype(np.intp)[:, None] + np.arange(-band, band + 1)
+        inside = None
+        if xs.min() < 0 or xs.max() >= w:
+            inside = (xs >= 0) & (xs < w)
+            np.clip(xs, 0, w - 1, out=xs)
+
+        # Flat indices, np.take is a lot cheaper than 2D fancy indexing
+        white = np.take(binary.reshape(-1), xs + (rows * w)[:, None]) > 0
+        if inside is not None:
+            white &= inside
+        return np.count_nonzero(white, axis=1), (white * xs).sum(axis=1)
+
+    def track(self, binary: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        (left, right) boundaries from the bands around the predicted lines,
+        or None when the full pipeline has to run.
+        """
+        if not self.active or self.frames_since_full >= config.TRACK_REFRESH_FRAMES:
+            return None
+
+        h = binary.shape[0]
+        rows = np.arange(h)
+        t = (h - 1 - rows) / max(h - 1, 1)
+        x_left = self.left.x_at(t)
+        x_right = self.right.x_at(t)
+
+        samples = []
+        explained = 0
+        for x_pred in (x_left, x_right):
+            count, x_sum = self._sample_band(binary, x_pred, rows)
+            hit = count > 0
+            if hit.sum() < config.TRACK_MIN_ROW_COVERAGE * h:
+                return None
+            samples.append((count, x_sum, hit))
+            explained += int(count.sum())
+
+        if cv2.countNonZero(binary) - explained > config.TRACK_MAX_OUTSIDE_PX:
+            return None
+
+        boundaries = []
+        for count, x_sum, hit in samples:
+            pts = np.column_stack((x_sum[hit] // count[hit], rows[hit])).astype(np.int32)
+            boundaries.append(bv.centered_safety_limit(pts))
+
+        return boundaries[0], boundaries[1]
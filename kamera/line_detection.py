@@ -2,7 +2,7 @@ from typing import List, Tuple
 import numpy as np
 import config
 
-from cluster import Cluster, ClusterType, get_cluster_points
+from cluster import Cluster, ClusterRuns, ClusterType
 
 def cluster_resembeles_line(cluster: Cluster) -> bool:    
     row_widths = cluster.row_widths
@@ -23,115 +23,157 @@ def cluster_resembeles_line(cluster: Cluster) -> bool:
 
 
 def remove_false_clusters(clusters: List[Cluster]):
+    """
+    Line thickness check. The bbox proportion check is already done on the
+    component stats in find_clusters, those clusters arrive as IGNORE and
+    their row geometry is never built.
+    """
     for cluster in clusters:
-        h = cluster.bbox[1] - cluster.bbox[0]
-        w = cluster.bbox[3] - cluster.bbox[2]
-
-        # Proportion check
-        if h / max(w, 1) < 0.25:
-            cluster.ctype = ClusterType.IGNORE
+        if cluster.ctype == ClusterType.IGNORE:
             continue
-        
+
         # Line thickness check
         if not cluster_resembeles_line(cluster):
             cluster.ctype = ClusterType.IGNORE
             continue
 
 
-def label_remaining_clusters(binary_labeled, clusters: List[Cluster]):
-    for cluster in clusters:
-        if cluster.ctype == ClusterType.CONTAINS_STOPLINE: 
-            continue
-        
-        if cluster.ctype == ClusterType.IGNORE:
-            continue
-        
-        # Check if left or right
-        roi_width = binary_labeled.shape[1]
-        roi_center_x = roi_width // 2
-
-        # Use bottom points to determine L/R
-        bottom_points = get_cluster_points(binary_labeled, cluster, method="center")
-        if len(bottom_points) == 0:
-            return
-
-        n_bottom = max(5, len(bottom_points) // 5)  # 20% or min 5
-        idx = np.argpartition(bottom_points[:,1], -n_bottom)[-n_bottom:]
-        lowest_part = bottom_points[idx]
-
-        avg_x_bottom = int(lowest_part[:, 0].mean())
-
-        # Classify based on L/R of center
-        if avg_x_bottom < roi_center_x:
-            cluster.ctype = ClusterType.LEFT
-        else:
-            cluster.ctype = ClusterType.RIGHT
-
-def _all_quadrants_activated(binary_labeled: np.ndarray, cluster: Cluster) -> bool:
+def label_remaining_clusters(runs: ClusterRuns, clusters: List[Cluster]) -> np.ndarray:
+    """
+    Classify every cluster not already STOPLINE/IGNORE as LEFT or RIGHT
+    of the ROI center, from the mean x of the row centers in its bottom
+    20% (min 5 rows). All candidates are done in one pass over their
+    stacked row arrays; clusters without pixel rows keep their type.
+
+    Returns a confidence per cluster (same order as clusters): distance
+    of that mean x from the center as a fraction of half the ROI width,
+    0 for clusters that were not classified.
+    """
+    confidence = np.zeros(len(clusters))
+    candidates = [i for i, c in enumerate(clusters)
+                  if c.ctype not in (ClusterType.CONTAINS_STOPLINE, ClusterType.IGNORE)]
+    if not candidates:
+        return confidence
+
+    roi_center_x = runs.shape[1] // 2
+
+    # Stacked rows of all candidates, only rows with pixels
+    widths = [clusters[i].row_widths for i in candidates]
+    owner = np.repeat(np.arange(len(candidates)), [len(w) for w in widths])
+    x0 = np.array([clusters[i].bbox[2] for i in candidates])
+    centers = np.concatenate([clusters[i].row_center for i in candidates]) + x0[owner]
+    valid = np.concatenate(widths) > 0
+    owner, centers = owner[valid], centers[valid]
+
+    # Rows are in y order, so the bottom rows are the last n_bottom of each cluster
+    n_rows = np.bincount(owner, minlength=len(candidates))
+    n_bottom = np.minimum(np.maximum(5, n_rows // 5), n_rows)  # 20% or min 5
+    from_end = n_rows[owner] - (np.arange(owner.size) - (np.cumsum(n_rows) - n_rows)[owner])
+    bottom = from_end <= n_bottom[owner]
+
+    x_sum = np.bincount(owner[bottom], weights=centers[bottom], minlength=len(candidates))
+    has_rows = n_rows > 0
+    avg_x_bottom = (x_sum[has_rows] / n_bottom[has_rows]).astype(int)
+
+    # Classify based on L/R of center
+    classified = np.array(candidates)[has_rows]
+    is_left = avg_x_bottom < roi_center_x
+    for i, left in zip(classified.tolist(), is_left.tolist()):
+        clusters[i].ctype = ClusterType.LEFT if left else ClusterType.RIGHT
+
+    confidence[classified] = np.minimum(np.abs(avg_x_bottom - roi_center_x) / max(roi_center_x, 1), 1.0)
+    return confidence
+
+def _all_quadrants_activated(cluster: Cluster) -> bool:
     """ Return True if all quadrants inside the cluster ROI contain
-        at least one pixel with this cluster's id.
+        at least one pixel of the cluster, from its row profiles.
     """
-    y_slice, x_slice = cluster.slice
+    y0, y1, x0, x1 = cluster.bbox
     lim = config.ACTIVATION_SQUARES_OF_ROI
-    cl = (binary_labeled[y_slice, x_slice] == cluster.id)
 
-    h, w = cl.shape
+    h, w = y1 - y0, x1 - x0
     if h == 0 or w == 0:
         return False
 
     y_cut = int(lim * (h / 2))
     x_cut = int(lim * (w / 2))
 
-    q1 = cl[0:y_cut, 0:x_cut].any()            # top-left
-    q2 = cl[h - y_cut:h, 0:x_cut].any()        # bottom-left
-    q3 = cl[0:y_cut, w - x_cut:w].any()        # top-right
-    q4 = cl[h - y_cut:h, w - x_cut:w].any()    # bottom-right
-
-    return q1 and q2 and q3 and q4
+    # Rows reaching into the left / right squares (bbox-local x)
+    has = cluster.row_widths > 0
+    left = has & (cluster.row_left < x_cut)
+    right = has & (cluster.row_right >= w - x_cut)
 
+    top = slice(0, y_cut)
+    bottom = slice(h - y_cut, h)
 
-def find_stop_line(binary, clusters: List[Cluster]) -> Tuple[int, int] | None:
-    for cluster in clusters:
-        width = cluster.bbox[3] - cluster.bbox[2]
-        height = cluster.bbox[1] - cluster.bbox[0]
-        if width > config.STOP_LINE_MIN_WIDTH and height > config.STOP_LINE_MIN_HEIGHT:
-            if not _all_quadrants_activated(binary, cluster): continue
+    q1 = left[top].any()                # top-left
+    q2 = left[bottom].any()             # bottom-left
+    q3 = right[top].any()               # top-right
+    q4 = right[bottom].any()            # bottom-right
 
-            cluster.ctype = ClusterType.CONTAINS_STOPLINE
+    return q1 and q2 and q3 and q4
 
-            # Extract pixels belonging to current cluster
-            y_slice, x_slice = cluster.slice
-            cluster_mask = binary[y_slice, x_slice] > 0
 
-            if not np.any(cluster_mask):
-                continue
+def _bottom_mean_row(profile: np.ndarray, k: int) -> float:
+    """
+    Mean row of the k bottom-most pixels, given pixels per row.
+    """
+    from_bottom = profile[::-1]
+    before = np.cumsum(from_bottom) - from_bottom
 
-            ys_all, xs_all = np.where(cluster_mask)
-            ys_all = ys_all + y_slice.start      # ROI coordinates
-            xs_all = xs_all + x_slice.start
+    # Whole rows until k pixels are covered, last one partially
+    taken = np.clip(k - before, 0, from_bottom)
+    rows = np.arange(len(profile) - 1, -1, -1)
+    return float((rows * taken).sum()) / k
 
-            if len(xs_all) == 0:
-                continue
 
-            # Mask middle 10%
-            w_local = x_slice.stop - x_slice.start
-            mid_start = int(w_local * 0.40)
-            mid_end   = int(w_local * 0.60)
-            central_strip_mask = (xs_all >= x_slice.start + mid_start) & \
-                                (xs_all <  x_slice.start + mid_end)
+def find_stop_line(runs: ClusterRuns, clusters: List[Cluster],
+                   min_width: float = config.STOP_LINE_MIN_WIDTH,
+                   min_height: float = config.STOP_LINE_MIN_HEIGHT) -> Tuple[int, int] | None:
+    """
+    First cluster big enough (bbox only) with pixels in all four quadrants
+    is the stop line. Returns (cent_x, cent_y): mean x of the pixels in
+    its bbox and mean y of the bottom 30% of those in the central strip
+    (40-60% of the bbox width), from per-row profiles of the runs.
+    """
+    for cluster in clusters:
+        width = cluster.bbox[3] - cluster.bbox[2]
+        height = cluster.bbox[1] - cluster.bbox[0]
+        if width > min_width and height > min_height:
+            if not _all_quadrants_activated(cluster): continue
 
-            if not np.any(central_strip_mask):
-                ys_central = ys_all # Fallback
-            else:
-                ys_central = ys_all[central_strip_mask]
-            
-            cent_x = int(np.average(xs_all))
+            cluster.ctype = ClusterType.CONTAINS_STOPLINE
 
-            # Get y as mean from bottom 20% of central pixels
-            k = max(1, int(len(ys_central) * 0.30))
-            idx = np.argpartition(ys_central, -k)[-k:]
-            cent_y = int(ys_central[idx].mean())
+            # Runs inside the bbox: this cluster and any other cluster whose
+            # bbox overlaps it (bbox test first, no scan over all runs)
+            y0, y1, x0, x1 = cluster.bbox
+            parts = [runs.cluster_slice(c.id) for c in clusters
+                     if c.bbox[0] < y1 and c.bbox[1] > y0 and c.bbox[2] < x1 and c.bbox[3] > x0]
+            idx = np.concatenate([np.arange(sl.start, sl.stop) for sl in parts])
+            xs = np.maximum(runs.x_start[idx], x0)
+            xe = np.minimum(runs.x_end[idx], x1)
+            rows = runs.row[idx] - y0
+            inside = (rows >= 0) & (rows < height) & (xe > xs)
+            rows, xs, xe = rows[inside], xs[inside], xe[inside]
+            lengths = xe - xs
+
+            # Sum of x over each run: n * (first + last) / 2
+            x_sum = int(((xs + xe - 1) * lengths // 2).sum())
+            cent_x = int(x_sum / int(lengths.sum()))
+
+            # Pixels per row inside the central strip, one reduction
+            mid_start = x0 + int(width * 0.40)
+            mid_end   = x0 + int(width * 0.60)
+            central = np.maximum(np.minimum(xe, mid_end) - np.maximum(xs, mid_start), 0)
+            profile = np.bincount(rows, weights=central, minlength=height)
+
+            if not profile.any():
+                profile = np.bincount(rows, weights=lengths, minlength=height) # Fallback
+
+            # Get y as mean from bottom 30% of central pixels
+            k = max(1, int(int(profile.sum()) * 0.30))
+            cent_y = int(y0 + _bottom_mean_row(profile, k))
 
             return (cent_x, cent_y)
 
-    return None
\ No newline at end of file
+    return None
@@ -0,0 +1,123 @@
+"""
+Compact binary overlay message, sent per frame on the overlay side channel
+(config.OVERLAY_PORT, same [4-byte length][payload] framing as the video).
+
+All points are full-frame pixel coords, big-endian:
+
+    header  !2sBBIfHHhhhhhhhhh
+        magic       b"OV"
+        version     u8  (OVERLAY_VERSION)
+        flags       u8  (FLAG_*)
+        seq         u32 (same as "seq=" in the JPEG COM segment)
+        heading     f32 (degrees)
+        frame_w/h   u16, u16
+        roi_x/y     i16, i16 (ROI offset)
+        stop_x/y    i16, i16
+        stop_x0/x1  i16, i16 (stop line extent)
+        target_x/y  i16, i16
+        cam_x_off   i16 (config.CAMERA_X_OFFSET, heading origin = frame_w / 2 + this)
+    4 x polyline    u16 count + count * (i16 x, i16 y)
+        left boundary, right boundary, target path, other path
+
+Decoder for the GUI side lives in TCP/win_gui_new2.py, keep them in sync.
+"""
+import struct
+from typing import Optional
+import numpy as np
+import cluster as cl
+import config
+
+OVERLAY_MAGIC = b"OV"
+OVERLAY_VERSION = 2
+
+FLAG_INTERSECTION = 0x01
+FLAG_STOP = 0x02
+FLAG_TARGET = 0x04
+FLAG_BOTH_EDGES = 0x08
+
+_HEADER = struct.Struct("!2sBBIfHHhhhhhhhhh")
+_COUNT = struct.Struct("!H")
+_EMPTY = np.empty((0, 2), dtype=np.int32)
+
+
+def _pack_polyline(pts: Optional[np.ndarray], offset: np.ndarray) -> bytes:
+    if pts is None or len(pts) == 0:
+        pts = _EMPTY
+    full = (np.asarray(pts).reshape(-1, 2) + offset).astype(">i2")
+    return _COUNT.pack(len(full)) + full.tobytes()
+
+
+def pack_overlay(seq: int, res, frame_shape, intersection_is_active: bool) -> bytes:
+    """
+    Serialize the drawable parts of a FrameResult.
+    """
+    off_x, off_y = (int(v) for v in res.roi_offset)
+    offset = np.array([off_x, off_y], dtype=np.int32)
+
+    flags = 0
+    if intersection_is_active:
+        flags |= FLAG_INTERSECTION
+    if res.both_edges_found:
+        flags |= FLAG_BOTH_EDGES
+
+    stop_x = stop_y = stop_x0 = stop_x1 = 0
+    if res.stop_point is not None:
+        stop_cluster = next((c for c in res.clusters
+                             if c.ctype == cl.ClusterType.CONTAINS_STOPLINE), None)
+        if stop_cluster is not None:
+            flags |= FLAG_STOP
+            stop_x, stop_y = (int(v) for v in np.add(res.stop_point, offset))
+            stop_x0 = int(stop_cluster.bbox[2]) + off_x
+            stop_x1 = int(stop_cluster.bbox[3]) + off_x
+
+    target_x = target_y = 0
+    if res.target_point is not None:
+        flags |= FLAG_TARGET
+        target_x, target_y = (int(v) for v in res.target_point)
+
+    left, right = res.boundaries
+    return b"".join((
+        _HEADER.pack(OVERLAY_MAGIC, OVERLAY_VERSION, flags, seq & 0xFFFFFFFF,
+                     float(res.heading), frame_shape[1], frame_shape[0],
+                     off_x, off_y, stop_x, stop_y, stop_x0, stop_x1, target_x, target_y,
+                     int(config.CAMERA_X_OFFSET)),
+        _pack_polyline(left, offset),
+        _pack_polyline(right, offset),
+        _pack_polyline(res.target_path, offset),
+        _pack_polyline(res.other_path, offset),
+    ))
+
+
+def unpack_overlay(data: bytes) -> dict:
+    """
+    Inverse of pack_overlay. Polylines come back as (N, 2) int32 arrays.
+    """
+    (magic, version, flags, seq, heading, frame_w, frame_h, roi_x, roi_y,
+     stop_x, stop_y, stop_x0, stop_x1, target_x, target_y, cam_x_off) = _HEADER.unpack_from(data)
+    if magic != OVERLAY_MAGIC or version != OVERLAY_VERSION:
+        raise ValueError(f"Unknown overlay message {magic!r} v{version}")
+
+    pos = _HEADER.size
+    lines = []
+    for _ in range(4):
+        (n,) = _COUNT.unpack_from(data, pos)
+        pos += _COUNT.size
+        pts = np.frombuffer(data, dtype=">i2", count=2 * n, offset=pos).reshape(n, 2)
+        lines.append(pts.astype(np.int32))
+        pos += 4 * n
+
+    return {
+        "seq": seq,
+        "heading": heading,
+        "intersection": bool(flags & FLAG_INTERSECTION),
+        "both_edges": bool(flags & FLAG_BOTH_EDGES),
+        "frame_size": (frame_w, frame_h),
+        "roi_offset": (roi_x, roi_y),
+        "cam_x_offset": cam_x_off,
+        "stop": (stop_x, stop_y, stop_x0, stop_x1) if flags & FLAG_STOP else None,
+        "target": (target_x, target_y) if flags & FLAG_TARGET else None,
+        "left": lines[0],
+        "right": lines[1],
+        "target_path": lines[2],
+        "other_path": lines[3],
+    }
@@ -1,16 +1,17 @@
 import numpy as np
-from collections import defaultdict
 
-def _y_to_mean_x(points: np.ndarray) -> dict[int, float]:
+def _y_to_mean_x(points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
     """
-    Given an array of [x, y] points, return mean of x for y
+    Given an array of [x, y] points, return sorted unique y and mean of x for each y
     """
     pts = np.asarray(points).reshape(-1, 2)
-    buckets = defaultdict(list)
-    for x, y in pts:
-        buckets[int(y)].append(float(x))
+    order = np.argsort(pts[:, 1], kind="stable")
+    xs = pts[order, 0].astype(float)
+    ys = pts[order, 1].astype(int)
 
-    return {y: float(np.mean(xs)) for y, xs in buckets.items()}
+    ys_unique, starts, counts = np.unique(ys, return_index=True, return_counts=True)
+    mean_xs = np.add.reduceat(xs, starts) / counts
+    return ys_unique, mean_xs
 
 
 def widths_on_common_y(left_boundary: np.ndarray,
@@ -25,18 +26,13 @@ def widths_on_common_y(left_boundary: np.ndarray,
     if left_boundary.size == 0 or right_boundary.size == 0:
         return np.array([]), np.array([])
 
-    left_map = _y_to_mean_x(left_boundary)
-    right_map = _y_to_mean_x(right_boundary)
+    left_ys, left_xs = _y_to_mean_x(left_boundary)
+    right_ys, right_xs = _y_to_mean_x(right_boundary)
 
-    # Only y's that exist in both maps
-    common_ys = sorted(set(left_map.keys()) & set(right_map.keys()))
-    if len(common_ys) == 0:
+    # Only y's that exist in both
+    ys, l_idx, r_idx = np.intersect1d(left_ys, right_ys, assume_unique=True, return_indices=True)
+    if ys.size == 0:
         return np.array([]), np.array([])
 
-    ys = np.array(common_ys, dtype=int)
-    l_xs = np.array([left_map[y] for y in common_ys], dtype=float)
-    r_xs = np.array([right_map[y] for y in common_ys], dtype=float)
-
-    widths = np.abs(r_xs - l_xs)
+    widths = np.abs(right_xs[r_idx] - left_xs[l_idx])
     return ys, widths
-
@@ -1,30 +1,42 @@
-# Runs only on Raspberry Pi
+# Runs only on Raspberry Pi. Off the Pi, KAMERA_FAKE_CAMERA=1 serves stored
+# images through fake_picamera2 instead (never set on the car).
+import os
 
-from picamera2 import Picamera2
-import cv2
+if os.environ.get("KAMERA_FAKE_CAMERA") == "1":
+    from fake_picamera2 import FakePicamera2 as Picamera2
+    print("KAMERA_FAKE_CAMERA=1, using FakePicamera2")
+else:
+    from picamera2 import Picamera2
+import numpy as np
 import socket
+import signal
 import time
-from enum import Enum
-import os
 import config
 from streamer import FrameTCPStreamer
-from process_frame import process_frame, Direction
+from process_frame import process_frame
+from drive_state import DriveStateMachine, Poll
 import visualization
-from collections import deque
-import find_boundries as fb
-
-class Action(Enum):
-    LEFT = 'V'
-    RIGHT = 'H'
-    STOP_NA = 'S'
-    STOP = 'B'
+import threading
+import boundary_validation as bv
+from stages import LatestSlot, RateLimiter, StageWorker, pin_current_thread
+from adaptive_encoder import AdaptiveJpegEncoder
+from pipeline_context import roi_bounds
+from overlay_protocol import pack_overlay
+from frame_header import FrameMeta
+import capture
+from profiler import profiler
+from blackbox import BlackBoxRecorder
 
 SOCKET_PATH = "/tmp/cam_offset.sock"
-JPEG_QUALITY = 60
 SOCKET_PATH_CPP_TO_PY = "/tmp/cpp_to_py.sock"
 
 picam2 = Picamera2()
-streamer = FrameTCPStreamer(host="0.0.0.0", port=config.PORT)
+streamer = FrameTCPStreamer(host="0.0.0.0", port=config.PORT,
+                            cpu_core=config.STAGE_CORES["stream"], negotiate=True)
+overlay_streamer = FrameTCPStreamer(host="0.0.0.0", port=config.OVERLAY_PORT,
+                                    cpu_core=config.STAGE_CORES["stream"])
+encoder = AdaptiveJpegEncoder()
+freeze_requested = threading.Event()     # Set by SIGUSR1 (freeze button)
 _udps = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
 _rx_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
 _rx_sock.setblocking(False)
@@ -36,18 +48,30 @@ except FileNotFoundError:
 _rx_sock.bind(SOCKET_PATH_CPP_TO_PY)
 
 def picam_init():
-    cam_cfg = picam2.create_preview_configuration(
-        main={"format": "RGB888", "size": (config.FRAME_W, config.FRAME_H)}
-    )
-    picam2.configure(cam_cfg)
+    capture.configure(picam2)
     picam2.start()
 
 def streamer_init():
     streamer.start()
+    overlay_streamer.start()
+
+def blackbox_init():
+    """ Ring recorder + SIGUSR1 freeze trigger, None with BLACKBOX off. """
+    if not config.BLACKBOX:
+        return None
+    roi = roi_bounds() if config.BLACKBOX_ROI_ONLY else None
+    try:
+        recorder = BlackBoxRecorder(config.BLACKBOX_PATH, config.BLACKBOX_CAPACITY,
+                                    (config.FRAME_H, config.FRAME_W), roi)
+    except OSError as e:
+        print(f"Black box disabled: {e}")
+        return None
+    signal.signal(signal.SIGUSR1, lambda *_: freeze_requested.set())
+    return recorder
 
 def capture_frame():
-    frame = picam2.capture_array()
-    return frame
+    """ Returns (CapturedFrame, sensor timestamp in ns on the monotonic clock). """
+    return capture.capture(picam2)
 
 def quantize_heading_to_7bit(heading_deg: float, v_min=-25.0, v_max=25.0) -> int:
     """
@@ -66,13 +90,76 @@ def send_heading(heading_deg: float):
     except Exception:
         pass
 
-def send_image(frame):
+def send_image(frame, meta: FrameMeta = None):
+    """ frame: BGR image or a CapturedFrame (converted only if a client listens). """
     if streamer.has_client():
-        ok, jpg = cv2.imencode(
-            ".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]
-        )
-        if ok:
-            streamer.push_jpeg(jpg.tobytes())
+        encoder.update(streamer.client_stats())
+        t0 = time.monotonic_ns()
+        if isinstance(frame, capture.CapturedFrame):
+            frame = frame.bgr()
+        parts = encoder.encode(frame, roi_bounds(), meta.seq if meta else None)
+        if parts:
+            if meta:
+                meta.encode_done_ns = time.monotonic_ns()
+                meta.jpeg_ns = meta.encode_done_ns - t0
+            streamer.push_parts(parts, meta)
+
+def capture_loop(stop: threading.Event, out: LatestSlot):
+    """ Capture stage: keep the newest camera frame (and its FrameMeta) in out. """
+    seq = 0
+    while not stop.is_set():
+        frame, ts = capture_frame()
+        seq += 1
+        out.put((frame, FrameMeta(seq, ts)))
+
+
+def encode_loop(stop: threading.Event, inp: LatestSlot):
+    """
+    Visualization/encoding stage, never blocks the vision stage.
+    config.STREAM_OVERLAY:
+        "burned"   -> draw overlays into the frame, stream JPEG
+        "vector"   -> stream raw JPEG + overlay geometry on the side channel
+        "geometry" -> overlay geometry only, no JPEG encode
+    """
+    overlay = None  # Single reused overlay buffer
+    while not stop.is_set():
+        item = inp.get(timeout=0.5)
+        if item is None:
+            continue
+
+        frame, res, intersection_is_active, meta = item
+        meta.encode_dropped = inp.dropped
+        profiler.begin_frame()
+
+        if res is None:
+            send_image(frame, meta)
+
+        elif config.STREAM_OVERLAY == "burned":
+            bgr = frame.bgr()
+            if overlay is None or overlay.shape != bgr.shape:
+                overlay = np.empty_like(bgr)
+            t0 = time.monotonic_ns()
+            img = visualization.build(bgr, res, intersection_is_active, out=overlay)
+            meta.overlay_ns = time.monotonic_ns() - t0
+            send_image(img, meta)
+
+        else:
+            if overlay_streamer.has_client():
+                t0 = time.monotonic_ns()
+                msg = pack_overlay(meta.seq, res, frame.shape, intersection_is_active)
+                meta.overlay_ns = time.monotonic_ns() - t0
+                overlay_streamer.push_parts([msg])
+            if config.STREAM_OVERLAY == "vector":
+                send_image(frame, meta)
+
+        profiler.end_frame("encode")
+
+
+def want_visualization(limiter: RateLimiter) -> bool:
+    """ Only render when someone watches, and at most STREAM_FPS. """
+    watched = streamer.has_client() or overlay_streamer.has_client()
+    return watched and limiter.ready()
+
 
 def recv_uint8_array():
     data, _ = _rx_sock.recvfrom(1 + 255)
@@ -102,112 +189,89 @@ def send_stop(is_last = False):
 def main():
     picam_init()
     streamer_init()
+    recorder = blackbox_init()
+    if config.BOUNDARY_VALIDATION == "auto":
+        # Before the stage threads start, so it is timed on an idle CPU
+        print("Boundary validation crossover:", bv.calibrate())
+
+    # Capture -> vision (this thread) -> visualization/encode -> streamer
+    stop = threading.Event()
+    capture_slot = LatestSlot()
+    encode_slot = LatestSlot()
+    workers = [
+        StageWorker("capture", lambda ev: capture_loop(ev, capture_slot), stop,
+                    config.STAGE_CORES["capture"]),
+        StageWorker("encode", lambda ev: encode_loop(ev, encode_slot), stop,
+                    config.STAGE_CORES["encode"]),
+    ]
+    for w in workers:
+        w.start()
+    pin_current_thread(config.STAGE_CORES["vision"])
+    vis_limiter = RateLimiter(config.STREAM_FPS)
 
     print("Camera + streamer running. Press Ctrl+C to exit.")
     fps_t0 = time.time()
     frame_count = 0
-    vals = []
-
-    intersection_is_active = False
-
-    dir = Direction.LEFT
-    next_action: Action = Action.STOP_NA
-    action_completed = True
-    intersection_cntr = deque([False] * config.BUFFER_LENGTH, maxlen=config.BUFFER_LENGTH)
-    stopline_cntr = deque([False] * config.BUFFER_LENGTH, maxlen=config.BUFFER_LENGTH)
-    normal_road_cntr = deque([False] * config.BUFFER_LENGTH, maxlen=config.BUFFER_LENGTH)
-    stop_section_active = False
-    waiting_for_route = False
-    last_stop = False
+    state = DriveStateMachine()
+    lost_edges = 0
 
     try:
         while True:
-            frame = capture_frame()
+            item = capture_slot.get(timeout=1.0)
+            if item is None:
+                continue
+            frame, meta = item
+            meta.capture_dropped = capture_slot.dropped
 
             try:
                 new_vals = recv_uint8_array()
                 if new_vals:
-                    vals = new_vals
-                    print("Ny rutt: ", vals)
-                    action_completed = True
-                    last_stop = False
+                    state.set_route(new_vals)
             except BlockingIOError:
                 pass
-            
-            if action_completed:
-                if vals:
-                    waiting_for_route = False
-                    try:
-                        cmd = vals.pop(0)
-                        next_action = Action(chr(cmd))
-                        print("Nästa kommando:", chr(cmd))
-                        if next_action == Action.LEFT:
-                            dir = Direction.LEFT
-                        elif next_action == Action.RIGHT:
-                            dir = Direction.RIGHT
-                        
-                        action_completed = False
-                        if not vals:
-                            last_stop = True
-                    except ValueError:
-                        print("Recieved invalid byte:", cmd)
-                        continue
-                else:
-                    if not waiting_for_route:
-                        print("Inväntar ny rutt...")
-                        waiting_for_route = True
-
-                    send_image(frame)
-                    send_heading(0.0)
-                    time.sleep(0.05)
-                    continue
-
-            # Run vision processing pipeline
-            res = process_frame(frame, dir, force_dir=intersection_is_active)
-            intersection_cntr.append(res.other_path is not None)
-            
-            stopline_cntr.append(res.stop_point is not None)
-            
-            is_normal = res.both_edges_found and res.other_path is None
-            normal_road_cntr.append(is_normal)
-
-            # Check intersection
-            next_is_turn = (next_action == Action.LEFT or next_action == Action.RIGHT)
-            if intersection_cntr.count(True) >= config.INTO_THRESHOLD and not intersection_is_active and next_is_turn:
-                intersection_is_active = True
-                if dir == Direction.LEFT:
-                    print("Håller till vänster i korsning...")
-                elif dir == Direction.RIGHT:
-                    print("Håller till höger i korsning...")
-            elif normal_road_cntr.count(True) >= config.EXIT_THRESHOLD and intersection_is_active:
-                if res.median_lane_width and res.median_lane_width < 0.67:
-                    intersection_is_active = False
-                    action_completed = True
-                    print("Ute ur korsning.")
-            
-            # Check stopline
-            if stopline_cntr.count(True) >= config.INTO_THRESHOLD and not stop_section_active and not intersection_is_active:
-                stop_section_active = True
-                if next_action == Action.STOP and res.dist_to_stopline is not None:
-                    print("Hittade hållplats")   
-                    send_stop(last_stop)
-                else:
-                    print("Passerar stopplinje...")
-
-            elif stopline_cntr.count(False) >= config.EXIT_THRESHOLD and stop_section_active:
-                stop_section_active = False
-                action_completed = True
-
-                if next_action == Action.STOP:
-                    print("Lämnar hållplats.")
-                else:
-                    print("Stoplinje passerad.")
-            
-            # Send 7-bit heading
-            if intersection_is_active:
-                res.heading *= config.INTERSECTION_HEADING_MULTIPLIER
+
+            poll = state.poll()
+            if poll == Poll.SKIP:
+                continue
+            if poll == Poll.WAIT:
+                send_heading(0.0)
+                if recorder:
+                    recorder.record(meta.seq, meta.capture_ns, frame.gray, None, state)
+                if want_visualization(vis_limiter):
+                    encode_slot.put((frame, None, False, meta))
+                time.sleep(0.05)
+                continue
+
+            # Run vision processing pipeline, debug payload only if it will be drawn
+            visualize = want_visualization(vis_limiter)
+            t0 = time.monotonic_ns()
+            res = process_frame(frame.vision_input, state.dir,
+                                force_dir=state.intersection_is_active,
+                                detector=state.detector,
+                                debug=visualize)
+            meta.vision_done_ns = time.monotonic_ns()
+            meta.vision_ns = meta.vision_done_ns - t0
+
+            # Send 7-bit heading as soon as the state machine has scaled it
+            stop_cmd = state.update(res)
             send_heading(res.heading)
-            send_image(visualization.build(frame, res, intersection_is_active))
+            if stop_cmd is not None:
+                send_stop(stop_cmd)
+
+            if recorder:
+                recorder.record(meta.seq, meta.capture_ns, frame.gray, res, state)
+                left, right = res.boundaries
+                lost_edges = lost_edges + 1 if len(left) == 0 and len(right) == 0 else 0
+                if freeze_requested.is_set():
+                    freeze_requested.clear()
+                    recorder.freeze("button")
+                elif stop_cmd is not None:
+                    recorder.freeze("stop")
+                elif lost_edges == config.BLACKBOX_LOST_EDGES_FRAMES:
+                    recorder.freeze("lost_edges")
+
+            if visualize:
+                encode_slot.put((frame, res, state.intersection_is_active, meta))
         
             frame_count += 1
             if config.PERFORMANCE_LOGGING:
@@ -218,7 +282,13 @@ def main():
                     now = time.time()
                     elapsed = now - fps_t0
                     fps = frame_count / elapsed
-                    print(f"FPS: {fps:.1f}")
+                    print(f"FPS: {fps:.1f} (dropped: capture {capture_slot.dropped}, encode {encode_slot.dropped})")
+                    for c in streamer.client_stats():
+                        print(f"  Stream {c['addr'][0]}: {c['fps']:.1f} fps, {c['dropped']} dropped, "
+                              f"{c['latency_ms']:.1f} ms to wire (protocol v{c['version']})")
+                    print(f"  Stream setting: q={encoder.setting[1]} scale={encoder.setting[0]}")
+                    if profiler.enabled:
+                        print(profiler.report())
 
                     # reset for next batch
                     fps_t0 = now
@@ -230,11 +300,19 @@ def main():
         send_stop(is_last=True)
 
     finally:
+        stop.set()
+        capture_slot.close()
+        encode_slot.close()
+        for w in workers:
+            w.join(timeout=1.0)
         try:
             picam2.stop()
         except Exception:
             pass
         streamer.stop()
+        overlay_streamer.stop()
+        if recorder:
+            recorder.close()
         _udps.close()
         print("Exited.")
 
@@ -0,0 +1,124 @@
+import cv2
+import numpy as np
+import config
+from typing import Tuple
+
+
+def build_trapezoid_mask(width: int, height: int, top_scale: float) -> np.ndarray:
+    """
+    Create a single-channel (uint8) mask with a trapezoid:
+    """
+    top_scale = max(0.0, min(1.0, top_scale))
+
+    mask = np.zeros((height, width), dtype=np.uint8)
+
+    mid_x = width / 2.0
+    half_bottom = width / 2.0
+    half_top = half_bottom * top_scale
+
+    # Trapezoid corners (x, y)
+    top_left  = (int(mid_x - half_top), 0)
+    top_right = (int(mid_x + half_top), 0)
+    bot_right = (width - 1, height - 1)
+    bot_left  = (0, height - 1)
+
+    pts = np.array([top_left, top_right, bot_right, bot_left], dtype=np.int32)
+    cv2.fillConvexPoly(mask, pts, 255)
+
+    return mask
+
+
+def roi_bounds() -> Tuple[int, int, int, int]:
+    """
+    ROI (top, bottom, left, right) in full-frame coords.
+    """
+    top = int(config.FRAME_H * (1.0 - config.ROI_TOP))
+    bottom = int(config.FRAME_H * (1.0 - config.ROI_BOTTOM))
+    left = int(config.FRAME_W * config.HORIZONTAL_MARGIN)
+    right = int(config.FRAME_W * (1.0 - config.HORIZONTAL_MARGIN))
+    return top, bottom, left, right
+
+
+def _config_key(frame_shape) -> tuple:
+    """
+    Everything a context depends on. A change here means a new context.
+    """
+    return (
+        tuple(frame_shape),
+        config.FRAME_W, config.FRAME_H,
+        config.ROI_TOP, config.ROI_BOTTOM, config.HORIZONTAL_MARGIN, config.ROI_TOP_SCALE,
+        config.DILATION_ITER_COUNT,
+        config.STOP_LINE_MIN_WIDTH, config.STOP_LINE_MIN_HEIGHT,
+    )
+
+
+class ClusterBuffers:
+    """
+    Reusable images for cluster.find_clusters on a fixed ROI size.
+    """
+
+    def __init__(self, shape: Tuple[int, int]):
+        h, w = shape
+        self.shape = (h, w)
+        self.mask = np.empty((h, w), np.uint8)
+        self.dilated = np.empty((h, w), np.uint8)
+        self.labels = np.empty((h, w), np.int32)
+        self.edges = np.empty((h, w + 1), bool)
+        self.dilate_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+
+class PipelineContext:
+    """
+    Preallocated buffers and cached geometry for one resolution + config.
+
+    Every stage writes into its own buffer (via OpenCV dst=), so a steady-state
+    frame does not allocate any images. NOTE: buffers are reused, arrays handed
+    out (roi, binary, labeled) are only valid until the next frame.
+    """
+
+    def __init__(self, frame_shape: Tuple[int, ...]):
+        self.key = _config_key(frame_shape)
+        self.frame_shape = tuple(frame_shape)
+        channels = frame_shape[2] if len(frame_shape) > 2 else 1
+
+        # Resize is skipped entirely when the camera already delivers FRAME_W x FRAME_H
+        self.needs_resize = tuple(frame_shape[:2]) != (config.FRAME_H, config.FRAME_W)
+        resized_shape = (config.FRAME_H, config.FRAME_W) + ((channels,) if channels > 1 else ())
+        self.resized = np.empty(resized_shape, np.uint8) if self.needs_resize else None
+
+        # ROI bounds (full-frame coords)
+        self.top, self.bottom, self.left, self.right = roi_bounds()
+        self.roi_offset = (self.left, self.top)
+        self.roi_shape = (self.bottom - self.top, self.right - self.left)
+
+        h, w = self.roi_shape
+
+        # Preprocess buffers
+        self.gray = np.empty((h, w), np.uint8)
+        self.blur = np.empty((h, w), np.uint8)
+        self.binary = np.empty((h, w), np.uint8)
+        self.close_kernel = np.ones((3, 3), np.uint8)
+        self.trap_mask = None
+        if config.ROI_TOP_SCALE < 1.0:
+            self.trap_mask = build_trapezoid_mask(w, h, config.ROI_TOP_SCALE)
+
+        self.cluster = ClusterBuffers((h, w))
+
+        # Pixel thresholds (ints, compared against integer bbox sizes)
+        self.stop_line_min_width = int(config.STOP_LINE_MIN_WIDTH)
+        self.stop_line_min_height = int(config.STOP_LINE_MIN_HEIGHT)
+
+    def matches(self, frame_shape) -> bool:
+        return self.key == _config_key(frame_shape)
+
+
+_ctx: PipelineContext | None = None
+
+def get_context(frame_shape) -> PipelineContext:
+    """
+    Return the shared context, rebuilding it only if resolution or config changed.
+    """
+    global _ctx
+    if _ctx is None or not _ctx.matches(frame_shape):
+        _ctx = PipelineContext(frame_shape)
+    return _ctx
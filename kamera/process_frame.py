@@ -7,18 +7,37 @@ import line_detection as ld
 import find_boundries as fb
 import find_path as fp
 import config
+from lane_tracker import LaneTracker
+import scanline_detector as sd
+from pipeline_context import PipelineContext, get_context
 from dataclasses import dataclass
-from typing import Optional, Tuple
-
-if config.TIME_LOGGING:
-    import time
+from typing import List, Optional, Tuple
+from profiler import profiler
 
 class Direction(Enum):
     LEFT = 0
     RIGHT = 1
 
+class Detector(Enum):
+    FULL = "full"
+    SCANLINE = "scanline"   # Sparse rows only, see scanline_detector.py
+    AUTO = "auto"           # Scanline, full pipeline if the result looks suspect
+
 @dataclass
+class FrameDebug:
+    """ Intermediate results, only kept for visualization/overlays. """
+    roi: np.ndarray
+    runs: cl.ClusterRuns
+    clusters: List[cl.Cluster]
+
+
+@dataclass(slots=True)
 class FrameResult:
+    """
+    The control fields are always filled. roi/runs/clusters are only kept
+    when process_frame runs with debug=True (empty otherwise), so nothing
+    big outlives the frame unless someone will draw it.
+    """
     heading: float
     dist_to_stopline: Optional[np.ndarray]
     stop_point: Optional[Tuple[int, int]]
@@ -26,64 +45,52 @@ class FrameResult:
     target_path: np.ndarray
     other_path: Optional[np.ndarray]
     both_edges_found: bool
-    roi: np.ndarray
     roi_offset: Tuple[int, int]
-    labeled_binary: np.ndarray
-    clusters: cl.Cluster
     boundaries: Tuple[np.ndarray, np.ndarray]
     median_lane_width: Optional[float]
+    tracked: bool = False               # Boundaries came from the lane tracker
+    scanline: bool = False              # Boundaries came from the scanline detector
+    debug: Optional[FrameDebug] = None
 
-def _extract_roi(frame):
-    frame = cv2.resize(frame, (config.FRAME_W, config.FRAME_H))
-
-    top = int(config.FRAME_H * (1.0-config.ROI_TOP))
-    bottom = int(config.FRAME_H * (1.0 - config.ROI_BOTTOM))
-    left = int(config.FRAME_W * config.HORIZONTAL_MARGIN)
-    right = int(config.FRAME_W * (1.0 - config.HORIZONTAL_MARGIN))
-
-    roi = frame[top:bottom, left:right]
-    return roi, (left, top)
+    @property
+    def roi(self) -> Optional[np.ndarray]:
+        return self.debug.roi if self.debug else None
 
+    @property
+    def runs(self) -> Optional[cl.ClusterRuns]:
+        return self.debug.runs if self.debug else None
 
-def _build_trapezoid_mask(width: int, height: int, top_scale: float) -> np.ndarray:
-    """
-    Create a single-channel (uint8) mask with a trapezoid:
-    """
-    top_scale = max(0.0, min(1.0, top_scale))
-
-    mask = np.zeros((height, width), dtype=np.uint8)
+    @property
+    def clusters(self) -> List[cl.Cluster]:
+        return self.debug.clusters if self.debug else []
 
-    mid_x = width / 2.0
-    half_bottom = width / 2.0
-    half_top = half_bottom * top_scale
+    @property
+    def labeled_binary(self) -> Optional[np.ndarray]:
+        """ Full label image, built on demand (visualization only). """
+        return self.debug.runs.to_label_image() if self.debug else None
 
-    # Trapezoid corners (x, y)
-    top_left  = (int(mid_x - half_top), 0)
-    top_right = (int(mid_x + half_top), 0)
-    bot_right = (width - 1, height - 1)
-    bot_left  = (0, height - 1)
+def _extract_roi(frame, ctx: PipelineContext):
+    if ctx.needs_resize:
+        frame = cv2.resize(frame, (config.FRAME_W, config.FRAME_H), dst=ctx.resized)
 
-    pts = np.array([top_left, top_right, bot_right, bot_left], dtype=np.int32)
-    cv2.fillConvexPoly(mask, pts, 255)
+    roi = frame[ctx.top:ctx.bottom, ctx.left:ctx.right]
+    return roi, ctx.roi_offset
 
-    return mask
 
+def _preprocess(roi, ctx: PipelineContext):
+    # Grayscale input (Y plane from capture.py) is used as is
+    gray = roi if roi.ndim == 2 else cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY, dst=ctx.gray)
+    blur = cv2.GaussianBlur(gray, (5, 5), 0, dst=ctx.blur)
 
-def _preprocess(roi):
-    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, binary = cv2.threshold(blur, config.BLACK_THRESHOLD, 255, cv2.THRESH_BINARY_INV, dst=ctx.binary)
 
-    _, binary = cv2.threshold(blur, config.BLACK_THRESHOLD, 255, cv2.THRESH_BINARY_INV)
+    # Closing can not run in-place, blur buffer is free at this point
+    closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, ctx.close_kernel, dst=ctx.blur, iterations=1)
 
-    kernel = np.ones((3, 3), np.uint8)
-    binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel, iterations=1)
+    if ctx.trap_mask is None:
+        return closed
 
-    if config.ROI_TOP_SCALE < 1.0:
-        h, w = binary.shape[:2]
-        trap_mask = _build_trapezoid_mask(w, h, config.ROI_TOP_SCALE)
-        binary = cv2.bitwise_and(binary, trap_mask)
-
-    return binary
+    return cv2.bitwise_and(closed, ctx.trap_mask, dst=ctx.binary)
 
 
 def _compute_heading(center_x_fullframe: float) -> float:
@@ -115,9 +122,42 @@ def _roi_to_fullframe(point, offsets):
     """
     return np.add(point, offsets)
 
+def _detect_boundaries(binary, offset, ctx: PipelineContext):
+    """
+    Full detection: clusters, stop line, cluster labels and boundaries.
+    """
+    t = profiler.start()
+
+    # 3) Clusters
+    runs, clusters = cl.find_clusters(binary, ctx.cluster)
+    t = profiler.lap("clusters", t)
+
+    ld.remove_false_clusters(clusters)
+
+    # 4) Label clusters
+    stop_point = ld.find_stop_line(runs, clusters,
+                                   min_width=ctx.stop_line_min_width,
+                                   min_height=ctx.stop_line_min_height)
+    dist_to_stop = None
+    if stop_point:
+        dist_to_stop = _roi_to_fullframe(stop_point, offset)[1]
+
+    ld.label_remaining_clusters(runs, clusters)
+    t = profiler.lap("label", t)
+    
+    # 5) Boundries
+    left_boundary, right_boundary = fb.compute_lane_boundaries(runs, clusters)
+    profiler.lap("boundaries", t)
+
+    return runs, clusters, stop_point, dist_to_stop, left_boundary, right_boundary
+
 _prev_heading = 0.0
+_tracker = LaneTracker()
 
-def process_frame(frame, dir: Direction, force_dir: bool) -> FrameResult:
+def process_frame(frame, dir: Direction, force_dir: bool,
+                  ctx: Optional[PipelineContext] = None,
+                  detector: Optional[Detector] = None,
+                  debug: bool = True) -> FrameResult:
     global _prev_heading
     """
     Full pipeline:
@@ -128,60 +168,73 @@ def process_frame(frame, dir: Direction, force_dir: bool) -> FrameResult:
       5) Find lane
       6) Decide what to follow
       7) Compute heading based on lookahead point
-    """
-    if config.TIME_LOGGING:
-        t0 = round(time.time() * 10000)
-
-    # 1) ROI
-    roi, offset = _extract_roi(frame)
-
-    # 2) Binary
-    binary = _preprocess(roi)
-
-    if config.TIME_LOGGING:
-        t1 = round(time.time() * 10000)
-        print("Preproccess:", t1-t0)
-
-    # 3) Clusters
-    labeled_binary, clusters = cl.find_clusters(binary)
 
-    if config.TIME_LOGGING:
-        t2 = round(time.time() * 10000)
-        print("Cluster detection:", t2-t1)
+    With config.LANE_TRACKING, steps 3-5 are replaced by a band search around
+    the tracked lane lines while tracking is confident (see lane_tracker.py).
 
-    ld.remove_false_clusters(clusters)
+    detector picks the boundary detection for this frame, None = config.DETECTOR.
 
-    # 4) Label clusters
-    stop_point = ld.find_stop_line(labeled_binary, clusters)
-    dist_to_stop = None
-    if stop_point:
-        dist_to_stop = _roi_to_fullframe(stop_point, offset)[1]
+    debug=False drops roi/runs/clusters from the result (control fields only),
+    for frames that will not be visualized.
 
-    ld.label_remaining_clusters(labeled_binary, clusters)
+    ctx holds the preallocated buffers, if None the shared context for this
+    frame size is used. Arrays in the result are only valid until next frame.
+    """
+    if ctx is None:
+        ctx = get_context(frame.shape)
+    if detector is None:
+        detector = Detector(config.DETECTOR)
 
-    if config.TIME_LOGGING:
-        t3 = round(time.time() * 10000)
-        print("Label clusters:", t3-t2)
-    
-    # 5) Boundries
-    left_boundary, right_boundary = fb.compute_lane_boundaries(labeled_binary, clusters)
+    t = profiler.begin_frame()
 
-    if config.TIME_LOGGING:
-        t4 = round(time.time() * 10000)
-        print("Boundries:", t4-t3)
+    # 1) ROI
+    roi, offset = _extract_roi(frame, ctx)
+
+    scan = None
+    if detector != Detector.FULL:
+        scan = sd.detect(roi, ctx.trap_mask)
+        t = profiler.lap("scanline", t)
+        if detector == Detector.AUTO and scan.suspect:
+            scan = None
+
+    tracked = None
+    if scan is None:
+        # 2) Binary
+        binary = _preprocess(roi, ctx)
+        t = profiler.lap("preprocess", t)
+
+        if config.LANE_TRACKING and not force_dir:
+            tracked = _tracker.track(binary)
+            t = profiler.lap("tracker", t)
+
+    if scan is not None:
+        # 2-5) Boundaries from the sampled rows only
+        runs, clusters = cl.ClusterRuns.empty(ctx.roi_shape), []
+        stop_point = dist_to_stop = None
+        left_boundary, right_boundary = scan.left, scan.right
+    elif tracked is not None:
+        # 3-5) Boundaries straight from the tracked bands
+        runs, clusters = cl.ClusterRuns.empty(ctx.roi_shape), []
+        stop_point = dist_to_stop = None
+        left_boundary, right_boundary = tracked
+    else:
+        (runs, clusters, stop_point, dist_to_stop,
+         left_boundary, right_boundary) = _detect_boundaries(binary, offset, ctx)
+        t = profiler.start()
 
     # 6) Find possible paths
-    path_l = fp.compute_lane_center(left_boundary, right_boundary, roi_shape=binary.shape,
-                                         force_side="left")
-    path_r = fp.compute_lane_center(left_boundary, right_boundary, roi_shape=binary.shape,
-                                         force_side="right")
-    
-    if config.TIME_LOGGING:
-        t5 = round(time.time() * 10000)
-        print("Paths:", t5-t4)
+    centers = fp.compute_lane_centers(left_boundary, right_boundary, roi_shape=ctx.roi_shape)
+    path_l = centers.left
+    path_r = centers.right
+    t = profiler.lap("paths", t)
 
     # 7) Scan for intersection
-    diverging_paths = fp.detect_diverging_paths(path_l, path_r, binary.shape)
+    diverging_paths = fp.diverging_from_widths(centers.band_ys, centers.band_widths, ctx.roi_shape)
+
+    if config.LANE_TRACKING and scan is None:
+        reliable = stop_point is None and not diverging_paths and not force_dir
+        _tracker.update(left_boundary, right_boundary, ctx.roi_shape, reliable,
+                        tracked=tracked is not None)
 
     target_path = None
     other_path = None
@@ -196,16 +249,13 @@ def process_frame(frame, dir: Direction, force_dir: bool) -> FrameResult:
             if (diverging_paths):
                 other_path = path_l
     else:
-        target_path = fp.compute_lane_center(left_boundary, right_boundary, roi_shape=binary.shape,
-                                        force_side=None)
+        target_path = centers.combined
     
     both_edges_found = path_l is not None and path_r is not None
     if both_edges_found:
-        median_lane_width = fb.compute_median_lane((left_boundary, right_boundary), binary.shape[1])
+        median_lane_width = fb.compute_median_lane((left_boundary, right_boundary), ctx.roi_shape[1])
 
-    if config.TIME_LOGGING:
-        t6 = round(time.time() * 10000)
-        print("Intersections:", t6-t5)
+    t = profiler.lap("intersections", t)
 
     # 8) Compute heading based on lookahead point
     target_point = None
@@ -216,9 +266,8 @@ def process_frame(frame, dir: Direction, force_dir: bool) -> FrameResult:
         heading = _compute_heading(target_point[0])
         _prev_heading = heading
 
-    if config.TIME_LOGGING:
-        t7 = round(time.time() * 10000)
-        print("Total:", t7-t0)
+    profiler.lap("heading", t)
+    profiler.end_frame("process_frame")
 
     return FrameResult(
         heading=heading,
@@ -228,10 +277,10 @@ def process_frame(frame, dir: Direction, force_dir: bool) -> FrameResult:
         target_path=target_path,
         other_path=other_path,
         both_edges_found = both_edges_found,
-        roi=roi,
         roi_offset=offset,
-        labeled_binary=labeled_binary,
-        clusters=clusters,
         boundaries=(left_boundary, right_boundary),
-        median_lane_width=median_lane_width
+        median_lane_width=median_lane_width,
+        tracked=tracked is not None,
+        scanline=scan is not None,
+        debug=FrameDebug(roi, runs, clusters) if debug else None
     )
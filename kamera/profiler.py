@@ -0,0 +1,139 @@
+"""
+Low-overhead stage profiler.
+
+Stage times (perf_counter_ns) go into a fixed-size ring buffer, nothing
+is printed per frame. Usage in a hot path:
+
+    t = profiler.begin_frame()
+    ...
+    t = profiler.lap("preprocess", t)
+    ...
+    profiler.end_frame("process_frame")
+
+With config.PROFILING = False every call returns right away. A frame
+(begin_frame .. end_frame on one thread) longer than its budget is counted
+as an overrun, together with the stage that took the longest. report()
+gives per-stage percentiles and a histogram over the ring contents.
+"""
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+import numpy as np
+import config
+
+# Histogram bucket upper edges (ms), last bucket is everything above
+HIST_EDGES_MS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50)
+
+
+class StageProfiler:
+    def __init__(self, capacity: int = 4096, enabled: bool = False):
+        self.enabled = enabled
+        self.capacity = capacity
+        self._stage = np.zeros(capacity, dtype=np.int16)
+        self._dur = np.zeros(capacity, dtype=np.int64)
+        self._counter = itertools.count()      # next() is atomic under the GIL
+        self._written = 0
+        self._names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._ids_lock = threading.Lock()
+        self._local = threading.local()
+        self.overruns: Dict[str, int] = {}     # Culprit stage -> count
+        self.recent_overruns = deque(maxlen=10)
+
+    def _stage_id(self, name: str) -> int:
+        sid = self._ids.get(name)
+        if sid is None:
+            with self._ids_lock:
+                sid = self._ids.setdefault(name, len(self._names))
+                if sid == len(self._names):
+                    self._names.append(name)
+        return sid
+
+    def record(self, name: str, duration_ns: int) -> None:
+        i = next(self._counter)
+        slot = i % self.capacity
+        self._stage[slot] = self._stage_id(name)
+        self._dur[slot] = duration_ns
+        self._written = i + 1
+
+        frame = getattr(self._local, "frame", None)
+        if frame is not None:
+            frame[name] = frame.get(name, 0) + duration_ns
+
+    # -------- markers --------
+    def start(self) -> int:
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def lap(self, name: str, t0: int) -> int:
+        """ Record the time since t0 under name, returns now for the next lap. """
+        if not self.enabled:
+            return 0
+        now = time.perf_counter_ns()
+        self.record(name, now - t0)
+        return now
+
+    def begin_frame(self) -> int:
+        if not self.enabled:
+            return 0
+        self._local.frame = {}
+        self._local.frame_start = time.perf_counter_ns()
+        return self._local.frame_start
+
+    def end_frame(self, name: str, budget_ms: Optional[float] = None) -> None:
+        """ Record the whole frame under name and check it against the budget. """
+        if not self.enabled:
+            return
+        frame = getattr(self._local, "frame", None)
+        if frame is None:
+            return
+        self._local.frame = None
+        total = time.perf_counter_ns() - self._local.frame_start
+        self.record(name, total)
+
+        budget_ms = config.PROFILE_FRAME_BUDGET_MS if budget_ms is None else budget_ms
+        if total > budget_ms * 1e6:
+            culprit = max(frame, key=frame.get) if frame else name
+            self.overruns[culprit] = self.overruns.get(culprit, 0) + 1
+            self.recent_overruns.append((name, total / 1e6, culprit, frame[culprit] / 1e6 if frame else 0.0))
+
+    # -------- summaries --------
+    def summary(self) -> Dict[str, dict]:
+        """ Per stage: count, p50/p95/p99/max (ms) and histogram counts over the ring. """
+        n = min(self._written, self.capacity)
+        stages = self._stage[:n].copy()
+        durs = self._dur[:n] / 1e6
+        out = {}
+        for sid, name in enumerate(list(self._names)):
+            d = durs[stages == sid]
+            if d.size == 0:
+                continue
+            p50, p95, p99 = np.percentile(d, (50, 95, 99))
+            hist = np.bincount(np.searchsorted(HIST_EDGES_MS, d), minlength=len(HIST_EDGES_MS) + 1)
+            out[name] = {"count": int(d.size), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+                         "max_ms": float(d.max()), "hist": hist.tolist()}
+        return out
+
+    def report(self) -> str:
+        lines = [f"  {'stage':<16} {'n':>5} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7}  "
+                 f"hist (<= {', '.join(str(e) for e in HIST_EDGES_MS)}, more) ms"]
+        for name, s in self.summary().items():
+            lines.append(f"  {name:<16} {s['count']:>5} {s['p50_ms']:>7.2f} {s['p95_ms']:>7.2f} "
+                         f"{s['p99_ms']:>7.2f} {s['max_ms']:>7.2f}  {s['hist']}")
+        if self.overruns:
+            culprits = ", ".join(f"{k} {v}" for k, v in sorted(self.overruns.items(), key=lambda kv: -kv[1]))
+            lines.append(f"  Over budget: {culprits}")
+            for frame_name, total_ms, culprit, culprit_ms in self.recent_overruns:
+                lines.append(f"    {frame_name} {total_ms:.1f} ms, {culprit} {culprit_ms:.1f} ms")
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        self._counter = itertools.count()
+        self._written = 0
+        self.overruns.clear()
+        self.recent_overruns.clear()
+
+
+# Shared profiler for the whole process
+profiler = StageProfiler(config.PROFILE_RING_SIZE, config.PROFILING)
@@ -0,0 +1,333 @@
+"""
+Offline replay benchmark for process_frame + the drive state machine.
+
+Loads recorded frames from a directory, an archive (.zip / .tar[.gz])
+of images or a black-box file (.bbx, see blackbox.py), runs them through the same loop as picam.main (without camera
+or sockets) and reports per-stage latency percentiles, throughput and
+memory allocations. Results can be written as JSON and compared against
+an earlier run on the same dataset:
+
+    python replay_benchmark.py recordings/ --json new.json --compare old.json
+
+or two configurations on the same commit:
+
+    python replay_benchmark.py recordings/ --json dilate.json
+    python replay_benchmark.py recordings/ --cluster-backend union_find --compare dilate.json
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import time
+import tracemalloc
+import zipfile
+from typing import Dict, List
+import cv2
+import numpy as np
+import config
+import process_frame as pf
+from drive_state import DriveStateMachine, Poll
+from blackbox import BlackBoxReader
+import boundary_validation as bv
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+PERCENTILES = (50, 95, 99)
+
+# Stages timed by wrapping the module attribute process_frame calls through
+STAGES = [
+    ("roi", pf, "_extract_roi"),
+    ("preprocess", pf, "_preprocess"),
+    ("clusters", pf.cl, "find_clusters"),
+    ("remove_false", pf.ld, "remove_false_clusters"),
+    ("stop_line", pf.ld, "find_stop_line"),
+    ("label", pf.ld, "label_remaining_clusters"),
+    ("boundaries", pf.fb, "compute_lane_boundaries"),
+    ("tracker", pf._tracker, "track"),
+    ("scanline", pf.sd, "detect"),
+    ("centers", pf.fp, "compute_lane_centers"),
+    ("diverging", pf.fp, "diverging_from_widths"),
+]
+
+
+# ----------------------------------------------------------
+# Dataset
+# ----------------------------------------------------------
+def _decode(data: bytes) -> np.ndarray:
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def load_frames(path: str, gray: bool = False) -> List[np.ndarray]:
+    """
+    All images in a directory or archive, in name order, at FRAME_W x FRAME_H.
+    Black-box files give their grayscale frames in recording order.
+    """
+    if path.endswith(".bbx"):
+        reader = BlackBoxReader(path)
+        frames = [reader.frame(i) for i in range(len(reader))]
+        if not gray:
+            frames = [cv2.cvtColor(f, cv2.COLOR_GRAY2BGR) for f in frames]
+        return frames
+
+    blobs = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.lower().endswith(IMAGE_EXTS):
+                with open(os.path.join(path, name), "rb") as f:
+                    blobs.append(f.read())
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z:
+            for name in sorted(z.namelist()):
+                if name.lower().endswith(IMAGE_EXTS):
+                    blobs.append(z.read(name))
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as t:
+            for m in sorted(t.getmembers(), key=lambda m: m.name):
+                if m.isfile() and m.name.lower().endswith(IMAGE_EXTS):
+                    blobs.append(t.extractfile(m).read())
+    else:
+        raise ValueError(f"Not a directory or zip/tar archive: {path}")
+
+    frames = []
+    for data in blobs:
+        img = _decode(data)
+        if img is None:
+            continue
+        img = cv2.resize(img, (config.FRAME_W, config.FRAME_H))
+        if gray:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        frames.append(img)
+    return frames
+
+
+# ----------------------------------------------------------
+# Timing
+# ----------------------------------------------------------
+class StageTimer:
+    """
+    Wraps the STAGES functions, collects per-call times (ns) per frame.
+    """
+
+    def __init__(self):
+        self.samples: Dict[str, List[int]] = {name: [] for name, _, _ in STAGES}
+        self._frame: Dict[str, int] = {}
+        self._originals = []
+
+    def _wrap(self, name, fn):
+        frame = self._frame
+
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                frame[name] = frame.get(name, 0) + time.perf_counter_ns() - t0
+        return timed
+
+    def __enter__(self) -> "StageTimer":
+        for name, owner, attr in STAGES:
+            fn = getattr(owner, attr)
+            self._originals.append((owner, attr, fn))
+            setattr(owner, attr, self._wrap(name, fn))
+        return self
+
+    def __exit__(self, *exc) -> None:
+        for owner, attr, fn in reversed(self._originals):
+            if owner is pf._tracker:
+                delattr(owner, attr)        # Drop the instance override
+            else:
+                setattr(owner, attr, fn)
+        self._originals.clear()
+
+    def end_frame(self) -> None:
+        for name, ns in self._frame.items():
+            self.samples[name].append(ns)
+        self._frame.clear()
+
+
+def summarize(values_ns) -> dict:
+    v = np.asarray(values_ns, dtype=np.float64) / 1e6
+    if v.size == 0:
+        return {"count": 0}
+    out = {"count": int(v.size), "mean_ms": float(v.mean())}
+    for p in PERCENTILES:
+        out[f"p{p}_ms"] = float(np.percentile(v, p))
+    out["max_ms"] = float(v.max())
+    return out
+
+
+# ----------------------------------------------------------
+# Replay
+# ----------------------------------------------------------
+def replay(frames: List[np.ndarray], route: str, passes: int, track_alloc: bool) -> dict:
+    """
+    Run all frames `passes` times through process_frame + DriveStateMachine.
+    The route restarts whenever the state machine runs out of commands.
+    """
+    route_vals = [ord(c) for c in route]
+    state = DriveStateMachine()
+    totals, state_ns, alloc_peak, alloc_blocks = [], [], [], []
+    skipped = 0
+
+    gc0 = sum(s["collections"] for s in gc.get_stats())
+    if track_alloc:
+        tracemalloc.start()
+
+    with StageTimer() as timer, contextlib.redirect_stdout(io.StringIO()):
+        t_start = time.perf_counter()
+        for _ in range(passes):
+            for frame in frames:
+                poll = state.poll()
+                if poll == Poll.WAIT:
+                    state.set_route(route_vals)
+                    poll = state.poll()
+                if poll != Poll.DRIVE:
+                    skipped += 1
+                    continue
+
+                if track_alloc:
+                    tracemalloc.reset_peak()
+                    base, _ = tracemalloc.get_traced_memory()
+                    blocks = sys.getallocatedblocks()
+
+                t0 = time.perf_counter_ns()
+                res = pf.process_frame(frame, state.dir,
+                                       force_dir=state.intersection_is_active,
+                                       detector=state.detector,
+                                       debug=False)
+                t1 = time.perf_counter_ns()
+                state.update(res)
+                t2 = time.perf_counter_ns()
+
+                if track_alloc:
+                    alloc_peak.append(tracemalloc.get_traced_memory()[1] - base)
+                    alloc_blocks.append(sys.getallocatedblocks() - blocks)
+
+                totals.append(t1 - t0)
+                state_ns.append(t2 - t1)
+                timer.end_frame()
+        elapsed = time.perf_counter() - t_start
+
+    if track_alloc:
+        tracemalloc.stop()
+
+    stages = {name: summarize(v) for name, v in timer.samples.items() if v}
+    stages["state_machine"] = summarize(state_ns)
+    result = {
+        "frames": len(totals),
+        "skipped": skipped,
+        "elapsed_s": elapsed,
+        "throughput_fps": len(totals) / elapsed if elapsed > 0 else 0.0,
+        "process_frame": summarize(totals),
+        "stages": stages,
+        "gc_collections": sum(s["collections"] for s in gc.get_stats()) - gc0,
+    }
+    if track_alloc:
+        peak = np.asarray(alloc_peak, dtype=np.float64) / 1024
+        result["alloc"] = {
+            "peak_kb_p50": float(np.percentile(peak, 50)),
+            "peak_kb_p95": float(np.percentile(peak, 95)),
+            "peak_kb_max": float(peak.max()),
+            "net_blocks_mean": float(np.mean(alloc_blocks)),
+        }
+    return result
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# ----------------------------------------------------------
+# Output
+# ----------------------------------------------------------
+def print_report(result: dict, baseline: dict = None) -> None:
+    def row(name, s, base):
+        line = f"  {name:<14} {s['count']:>6} {s['p50_ms']:>8.3f} {s['p95_ms']:>8.3f} {s['p99_ms']:>8.3f}"
+        if base and base.get("count"):
+            line += f"   p50 {100 * (s['p50_ms'] / base['p50_ms'] - 1):+6.1f}%"
+        print(line)
+
+    base_stages = baseline["stages"] if baseline else {}
+    print(f"{result['frames']} frames ({result['skipped']} skipped), "
+          f"{result['throughput_fps']:.1f} fps, {result['gc_collections']} gc runs")
+    print(f"  {'stage':<14} {'calls':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    row("process_frame", result["process_frame"], baseline["process_frame"] if baseline else None)
+    for name, s in result["stages"].items():
+        if s["count"]:
+            row(name, s, base_stages.get(name))
+    if "alloc" in result:
+        a = result["alloc"]
+        print(f"  alloc peak/frame: p50 {a['peak_kb_p50']:.1f} kB, p95 {a['peak_kb_p95']:.1f} kB, "
+              f"max {a['peak_kb_max']:.1f} kB, net blocks {a['net_blocks_mean']:.1f}")
+    if baseline:
+        print(f"  throughput vs baseline ({baseline.get('commit', '?')}): "
+              f"{100 * (result['throughput_fps'] / baseline['throughput_fps'] - 1):+.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded frames through process_frame")
+    parser.add_argument("dataset", help="Directory, .zip/.tar archive of images or .bbx black-box file")
+    parser.add_argument("--passes", type=int, default=5, help="Times to run the whole dataset")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed passes first")
+    parser.add_argument("--route", default="S", help="Route commands (V/H/S/B), repeated")
+    parser.add_argument("--gray", action="store_true", help="Feed grayscale frames (YUV420 capture)")
+    parser.add_argument("--detector", choices=["full", "scanline", "auto"], help="Override config.DETECTOR")
+    parser.add_argument("--cluster-backend", choices=["dilate", "union_find"],
+                        help="Override config.CLUSTER_BACKEND")
+    parser.add_argument("--no-tracking", action="store_true", help="Set config.LANE_TRACKING = False")
+    parser.add_argument("--no-alloc", action="store_true", help="Skip allocation tracking")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Earlier JSON result to compare against")
+    args = parser.parse_args()
+
+    if args.detector:
+        config.DETECTOR = args.detector
+    if args.cluster_backend:
+        config.CLUSTER_BACKEND = args.cluster_backend
+    if args.no_tracking:
+        config.LANE_TRACKING = False
+
+    frames = load_frames(args.dataset, gray=args.gray)
+    if not frames:
+        raise SystemExit(f"No images in {args.dataset}")
+
+    if config.BOUNDARY_VALIDATION == "auto":
+        bv.calibrate()
+    if args.warmup:
+        replay(frames, args.route, args.warmup, track_alloc=False)
+    timing = replay(frames, args.route, args.passes, track_alloc=False)
+    if not args.no_alloc:
+        timing["alloc"] = replay(frames, args.route, 1, track_alloc=True)["alloc"]
+
+    result = {
+        "commit": _git_commit(),
+        "dataset": os.path.abspath(args.dataset),
+        "dataset_frames": len(frames),
+        "passes": args.passes,
+        "route": args.route,
+        "gray": args.gray,
+        "config": {"DETECTOR": config.DETECTOR, "LANE_TRACKING": config.LANE_TRACKING,
+                   "CLUSTER_BACKEND": config.CLUSTER_BACKEND},
+        **timing,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("dataset_frames") != len(frames):
+            print(f"Warning: baseline has {baseline.get('dataset_frames')} frames, this dataset {len(frames)}")
+
+    print_report(result, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,100 @@
+"""
+Sparse scanline lane detector.
+
+Cheap alternative to the full cluster pipeline: only SCANLINE_ROWS_PER_BAND
+rows per scanline band are converted, thresholded and split into dark tape
+runs. Runs between MIN_LINE_WIDTH_PX and MAX_LINE_WIDTH_PX wide are boundary
+candidates, the one closest to the ROI center on each side is kept per row.
+No dilation, no connected components.
+
+The result is flagged suspect when a row looks like more than plain lane
+tape (a run wider than MAX_LINE_WIDTH_PX, e.g. a stop line, or several tape
+runs on one side, e.g. a branching lane), so the caller can fall back to
+the full pipeline.
+"""
+from dataclasses import dataclass
+from typing import Optional
+import cv2
+import numpy as np
+import config
+import boundary_validation as bv
+import find_boundries as fb
+
+_EMPTY = np.empty((0, 2), dtype=np.int32)
+
+
+@dataclass
+class ScanlineResult:
+    left: np.ndarray
+    right: np.ndarray
+    suspect: bool
+
+
+def sample_rows(h: int) -> np.ndarray:
+    """
+    ROI rows to sample: SCANLINE_ROWS_PER_BAND evenly spread rows in each
+    of the SCANLINES bands used by find_path.
+    """
+    n = config.SCANLINES * config.SCANLINE_ROWS_PER_BAND
+    rows = np.round(np.linspace(0, h - 1, n + 2)[1:-1]).astype(np.intp)
+    return np.unique(rows)
+
+
+def binarize_rows(roi: np.ndarray, rows: np.ndarray,
+                  trap_mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Same threshold as process_frame._preprocess, on the sampled rows only
+    (horizontal blur, rows are not neighbours).
+    """
+    strip = roi[rows]
+    if strip.ndim == 3:
+        strip = cv2.cvtColor(strip, cv2.COLOR_BGR2GRAY)
+    strip = cv2.GaussianBlur(strip, (5, 1), 0)
+    _, binary = cv2.threshold(strip, config.BLACK_THRESHOLD, 255, cv2.THRESH_BINARY_INV)
+    if trap_mask is not None:
+        binary &= trap_mask[rows]
+    return binary
+
+
+def row_runs(binary: np.ndarray):
+    """
+    All white runs of a stack of rows: (row index, x_start, x_end), x_end exclusive.
+    """
+    h, w = binary.shape
+    padded = np.zeros((h, w + 2), dtype=np.int8)
+    padded[:, 1:-1] = binary > 0
+    r, c = np.nonzero(np.diff(padded, axis=1))
+    return r[0::2], c[0::2], c[1::2]
+
+
+def detect(roi: np.ndarray, trap_mask: Optional[np.ndarray] = None) -> ScanlineResult:
+    h, w = roi.shape[:2]
+    roi_center_x = w // 2
+    rows = sample_rows(h)
+
+    r, x_start, x_end = row_runs(binarize_rows(roi, rows, trap_mask))
+    widths = x_end - x_start
+
+    # Wider than tape: stop line or tape running along the row
+    suspect = bool((widths > config.MAX_LINE_WIDTH_PX).any())
+
+    tape = (widths >= config.MIN_LINE_WIDTH_PX) & (widths <= config.MAX_LINE_WIDTH_PX)
+    r, centers = r[tape], (x_start[tape] + x_end[tape] - 1) // 2
+    pts = np.column_stack((centers, rows[r])).astype(np.int32)
+
+    is_left = centers < roi_center_x
+    left_pts, right_pts = pts[is_left], pts[~is_left]
+
+    # Several tape runs on one side of a row -> possible branch
+    for side in (left_pts, right_pts):
+        if len(side) and np.bincount(side[:, 1]).max() > 1:
+            suspect = True
+
+    left = bv.centered_safety_limit(fb.select_closest_per_row(left_pts, roi_center_x))
+    right = bv.centered_safety_limit(fb.select_closest_per_row(right_pts, roi_center_x))
+
+    # A side seen in less than half the rows is as good as lost
+    if min(len(left), len(right)) < len(rows) // 2:
+        suspect = True
+
+    return ScanlineResult(left if len(left) else _EMPTY, right if len(right) else _EMPTY, suspect)
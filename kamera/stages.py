@@ -0,0 +1,92 @@
+"""
+Building blocks for the staged camera pipeline in picam.py.
+
+Stages run on their own threads and hand data over through LatestSlot,
+a one-element slot that always holds the newest value. A slow consumer
+never builds a backlog, it just skips to the latest item.
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+
+class LatestSlot:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._value: Any = None
+        self._has_value = False
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, value: Any) -> None:
+        """ Store value, replacing (dropping) an unread one. """
+        with self._cond:
+            if self._has_value:
+                self.dropped += 1
+            self._value = value
+            self._has_value = True
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """ Wait for a new value. Returns None on timeout or when closed. """
+        with self._cond:
+            self._cond.wait_for(lambda: self._has_value or self._closed, timeout)
+            if not self._has_value:
+                return None
+            value = self._value
+            self._value = None
+            self._has_value = False
+            return value
+
+    def close(self) -> None:
+        """ Wake up all waiting consumers. """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+def pin_current_thread(core: Optional[int]) -> None:
+    """
+    Pin the calling thread to one CPU core (Linux only). None = no pinning.
+    """
+    if core is None:
+        return
+    try:
+        os.sched_setaffinity(0, {core})
+    except (AttributeError, OSError) as e:
+        print(f"Could not pin {threading.current_thread().name} to core {core}: {e}")
+
+
+class StageWorker(threading.Thread):
+    """
+    Runs target(stop_event) on a daemon thread, optionally pinned to a core.
+    """
+
+    def __init__(self, name: str, target: Callable[[threading.Event], None],
+                 stop_event: threading.Event, core: Optional[int] = None):
+        super().__init__(name=name, daemon=True)
+        self._target_fn = target
+        self._stop_event = stop_event
+        self._core = core
+
+    def run(self) -> None:
+        pin_current_thread(self._core)
+        self._target_fn(self._stop_event)
+
+
+class RateLimiter:
+    """
+    ready() is True at most rate_hz times per second. rate_hz <= 0 = always.
+    """
+
+    def __init__(self, rate_hz: float):
+        self.interval = 1.0 / rate_hz if rate_hz > 0 else 0.0
+        self._next = 0.0
+
+    def ready(self) -> bool:
+        now = time.monotonic()
+        if now < self._next:
+            return False
+        self._next = now + self.interval
+        return True
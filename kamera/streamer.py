@@ -5,24 +5,140 @@ tcp_streamer.py
 Enkel TCP-streamer för JPEG-ramar (eller andra bytes).
 Protokoll: [4 byte big-endian längd] + payload
 
-- En klient åt gången (låg latens, droppar backlog).
-- Trådsäker push_jpeg() från din kameraloop.
+- Flera klienter samtidigt, var och en med egen sändtråd och egen
+  "senaste ram"-plats. En långsam klient droppar ramar utan att
+  bromsa de andra.
+- Trådsäker push_jpeg() från din kameraloop. Sändtråden väcks direkt
+  (condition), ingen sleep-pollning.
+- Header + payload skickas med en vektoriserad sendmsg, utan kopia.
+- Latens kö -> nätverk, genomströmning och sändkö (backlog) mäts per klient.
+- Med negotiate=True kan klienten be om metadata-header per ram (se
+  frame_header.py). Klienter som inte frågar får det gamla formatet.
 - start()/stop() eller använd som context manager.
 """
 
 from __future__ import annotations
+import select
 import socket
 import struct
 import threading
 import time
 from typing import Optional
 
+from stages import LatestSlot, pin_current_thread
+import frame_header as fh
+from profiler import profiler
+
+try:
+    import fcntl
+    import termios
+    _SIOCOUTQ = termios.TIOCOUTQ     # Linux: samma värde som SIOCOUTQ för TCP
+except (ImportError, AttributeError):
+    _SIOCOUTQ = None
+
+PEER_CHECK_INTERVAL = 1.0   # Sekunder mellan kontroller av tyst klient
+
+
+class _Client:
+    """ En ansluten klient: socket, senaste oskickade ram och statistik. """
+
+    def __init__(self, conn: socket.socket, addr):
+        self.conn = conn
+        self.addr = addr
+        self.slot = LatestSlot()
+        self.closed = False
+        self.version = fh.LEGACY_VERSION   # Protokollversion, sätts av hello
+
+        self.sent = 0
+        self.bytes_sent = 0
+        self.connected_at = time.monotonic()
+        self._last_send = None
+        self._dt_avg = None     # Glidande medel av tid mellan skickade ramar
+        self._rate_avg = 0.0    # Glidande medel av bytes/s
+
+        # Tid från push_jpeg() tills ramen ligger i socketen (sekunder)
+        self.latency_last = 0.0
+        self.latency_avg = 0.0
+        self.latency_max = 0.0
+
+    def record_send(self, n_bytes: int, queued_at: float) -> None:
+        now = time.monotonic()
+        if self._last_send is not None:
+            dt = max(now - self._last_send, 1e-6)
+            self._dt_avg = dt if self._dt_avg is None else 0.9 * self._dt_avg + 0.1 * dt
+            self._rate_avg = 0.9 * self._rate_avg + 0.1 * (n_bytes / dt)
+        self._last_send = now
+        self.sent += 1
+        self.bytes_sent += n_bytes
+
+        latency = now - queued_at
+        self.latency_last = latency
+        self.latency_avg = latency if self.sent == 1 else 0.9 * self.latency_avg + 0.1 * latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def backlog_bytes(self) -> int:
+        """ Oskickade bytes i kärnans sändbuffert (0 om det inte stöds). """
+        if _SIOCOUTQ is None:
+            return 0
+        try:
+            buf = fcntl.ioctl(self.conn.fileno(), _SIOCOUTQ, b"\0" * 4)
+            return struct.unpack("i", buf)[0]
+        except OSError:
+            return 0
+
+    def stats(self) -> dict:
+        return {
+            "addr": self.addr,
+            "version": self.version,
+            "sent": self.sent,
+            "dropped": self.slot.dropped,
+            "fps": (1.0 / self._dt_avg) if self._dt_avg else 0.0,
+            "kbps": self._rate_avg * 8 / 1000,
+            "backlog_bytes": self.backlog_bytes(),
+            "latency_ms": self.latency_avg * 1000,
+            "latency_max_ms": self.latency_max * 1000,
+        }
+
+
+def _send_vectored(sock: socket.socket, buffers: list) -> None:
+    """
+    Skicka alla buffrar med sendmsg (scatter/gather, ingen sammanslagning).
+    Hanterar delvisa skick. Faller tillbaka på sendall utan sendmsg (Windows).
+    """
+    if not hasattr(sock, "sendmsg"):
+        for b in buffers:
+            sock.sendall(b)
+        return
+
+    views = [memoryview(b) for b in buffers]
+    while views:
+        n = sock.sendmsg(views)
+        while views and n >= views[0].nbytes:
+            n -= views[0].nbytes
+            views.pop(0)
+        if views and n:
+            views[0] = views[0][n:]
+
+
+def _peer_closed(sock: socket.socket) -> bool:
+    """ True om klienten har stängt (läsbar men recv ger b"") eller socketen är trasig. """
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        return True
+
 
 class FrameTCPStreamer:
-    def __init__(self, host: str = "0.0.0.0", port: int = 6000, listen_backlog: int = 1):
+    def __init__(self, host: str = "0.0.0.0", port: int = 6000, listen_backlog: int = 4,
+                 cpu_core: Optional[int] = None, max_clients: int = 4,
+                 negotiate: bool = False):
         self.host = host
         self.port = port
         self.listen_backlog = listen_backlog
+        self.cpu_core = cpu_core
+        self.max_clients = max_clients
+        self.negotiate = negotiate
 
         self._srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -30,21 +146,16 @@ class FrameTCPStreamer:
         self._srv.listen(self.listen_backlog)
         self._srv.settimeout(1.0)
 
-        self._client: Optional[socket.socket] = None
+        self._clients: list[_Client] = []
         self._client_lock = threading.Lock()
 
-        self._latest: Optional[bytes] = None
-        self._latest_lock = threading.Lock()
-
         self._stop = threading.Event()
         self._th_accept = threading.Thread(target=self._accept_loop, daemon=True)
-        self._th_send = threading.Thread(target=self._send_loop, daemon=True)
 
     # -------- lifecycle --------
     def start(self) -> None:
         print(f"[TCP] Lyssnar på {self.host}:{self.port} …")
         self._th_accept.start()
-        self._th_send.start()
 
     def stop(self) -> None:
         self._stop.set()
@@ -53,12 +164,9 @@ class FrameTCPStreamer:
         except Exception:
             pass
         with self._client_lock:
-            if self._client:
-                try:
-                    self._client.close()
-                except Exception:
-                    pass
-                self._client = None
+            clients = list(self._clients)
+        for c in clients:
+            self._drop_client(c)
 
     def __enter__(self) -> "FrameTCPStreamer":
         self.start()
@@ -68,66 +176,125 @@ class FrameTCPStreamer:
         self.stop()
 
     # -------- public API --------
-    def push_jpeg(self, data: bytes) -> None:
+    def push_jpeg(self, data) -> None:
+        """
+        Lagra senaste JPEG-ram hos varje klient. Droppar tidigare oskickade
+        för låg latens. Anropa detta i din kameraloop när du har encodat en bild.
+        data: bytes eller valfri buffer (t.ex. arrayen från cv2.imencode),
+        den kopieras inte så den får inte ändras efteråt.
         """
-        Lagra senaste JPEG-ram (bytes). Droppar tidigare oskickade för låg latens.
-        Anropa detta i din kameraloop när du har encodat en bild.
+        self.push_parts([data])
+
+    def push_parts(self, parts: list, meta: Optional[fh.FrameMeta] = None) -> None:
+        """
+        Som push_jpeg, men payload ges som flera buffrar som skickas efter
+        varandra (t.ex. JPEG med inskjutet segment) utan att slås ihop.
+        meta: tidsstämplar för ramen, skickas som header till klienter
+        som förhandlat fram version 2.
         """
-        with self._latest_lock:
-            self._latest = data
+        parts = [memoryview(p).cast("B") for p in parts]
+        item = (parts, meta, time.monotonic())
+        with self._client_lock:
+            clients = list(self._clients)
+        for c in clients:
+            c.slot.put(item)
 
     def has_client(self) -> bool:
         with self._client_lock:
-            return self._client is not None
+            return len(self._clients) > 0
+
+    def client_stats(self) -> list[dict]:
+        """ Per klient: addr, sent, dropped, fps, kbps, backlog och latens kö -> nätverk. """
+        with self._client_lock:
+            return [c.stats() for c in self._clients]
 
     # -------- internal loops --------
     def _accept_loop(self) -> None:
         while not self._stop.is_set():
             try:
                 conn, addr = self._srv.accept()
-                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-                with self._client_lock:
-                    if self._client:
-                        try:
-                            self._client.close()
-                        except Exception:
-                            pass
-                    self._client = conn
-                print(f"[TCP] Klient ansluten: {addr}")
             except socket.timeout:
                 continue
             except OSError:
                 break
 
-    def _send_loop(self) -> None:
-        pack = struct.pack
-        while not self._stop.is_set():
-            # Hämta ev. klient
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             with self._client_lock:
-                cli = self._client
+                full = len(self._clients) >= self.max_clients
+                if not full:
+                    client = _Client(conn, addr)
+                    self._clients.append(client)
 
-            if not cli:
-                time.sleep(0.01)
+            if full:
+                print(f"[TCP] Max antal klienter, nekar: {addr}")
+                conn.close()
                 continue
 
-            # Plocka senaste frame atomärt
-            with self._latest_lock:
-                payload = self._latest
-                self._latest = None
+            threading.Thread(target=self._send_loop, args=(client,), daemon=True).start()
+            print(f"[TCP] Klient ansluten: {addr}")
+
+    def _read_hello(self, client: _Client) -> None:
+        """ Vänta kort på klientens hello, annars gammalt format. """
+        data = b""
+        client.conn.settimeout(fh.HELLO_TIMEOUT)
+        try:
+            while len(data) < 3:
+                chunk = client.conn.recv(3 - len(data))
+                if not chunk:
+                    break
+                data += chunk
+        except (socket.timeout, OSError):
+            pass
+        finally:
+            client.conn.settimeout(None)
+        client.version = fh.parse_hello(data)
+        print(f"[TCP] Klient {client.addr}: protokoll v{client.version}")
 
-            if payload is None:
-                time.sleep(0.002)
+    def _send_loop(self, client: _Client) -> None:
+        pin_current_thread(self.cpu_core)
+        if self.negotiate:
+            self._read_hello(client)
+        pack = struct.pack
+        while not self._stop.is_set() and not client.closed:
+            # Sov tills en ny frame pushas (eller klienten stängs). Vaknar
+            # periodiskt för att märka klienter som kopplar ner utan trafik.
+            item = client.slot.get(timeout=PEER_CHECK_INTERVAL)
+            if item is None:
+                if client.closed:
+                    break
+                if _peer_closed(client.conn):
+                    print(f"[TCP] Klient frånkopplad: {client.addr}")
+                    self._drop_client(client)
+                    break
                 continue
 
+            parts, meta, queued_at = item
+            if meta is not None and client.version >= fh.HEADER_VERSION:
+                parts = [fh.pack_header(meta, client.slot.dropped)] + parts
+            n_bytes = sum(len(p) for p in parts)
+            t = profiler.start()
             try:
-                cli.sendall(pack("!I", len(payload)))
-                cli.sendall(payload)
+                _send_vectored(client.conn, [pack("!I", n_bytes)] + parts)
             except (BrokenPipeError, ConnectionResetError, OSError):
-                print("[TCP] Klient frånkopplad.")
-                with self._client_lock:
-                    try:
-                        if self._client:
-                            self._client.close()
-                    except Exception:
-                        pass
-                    self._client = None
+                print(f"[TCP] Klient frånkopplad: {client.addr}")
+                self._drop_client(client)
+                break
+
+            profiler.lap("stream_send", t)
+            client.record_send(n_bytes, queued_at)
+
+    def _drop_client(self, client: _Client) -> None:
+        with self._client_lock:
+            if client in self._clients:
+                self._clients.remove(client)
+        client.closed = True
+        client.slot.close()
+        try:
+            # shutdown väcker en sändtråd som hänger i sendmsg, close gör det inte
+            client.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            client.conn.close()
+        except Exception:
+            pass
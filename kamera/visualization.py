@@ -4,6 +4,7 @@ import matplotlib.pyplot as plt
 from process_frame import FrameResult
 import config
 import cluster as cl  # assuming this defines ClusterType etc.
+from profiler import profiler
 
 COLORS = [
     (128, 0,   255),  # Purple
@@ -17,12 +18,20 @@ def get_color(cluster_id: int):
     return COLORS[cluster_id % len(COLORS)]
 
 
-def build(frame: np.ndarray, result: FrameResult, intersection_is_active:bool = True) -> np.ndarray:
+def build(frame: np.ndarray, result: FrameResult, intersection_is_active:bool = True,
+          out: np.ndarray | None = None) -> np.ndarray:
     """
     Draw visualization overlays directly onto the captured frame and return
     an RGB image suitable for plt.imshow().
+
+    out: reusable overlay buffer (same shape as frame) to avoid a new copy per frame.
     """
-    vis = frame.copy()
+    t = profiler.start()
+    if out is not None and out.shape == frame.shape:
+        np.copyto(out, frame)
+        vis = out
+    else:
+        vis = frame.copy()
     off_x, off_y = result.roi_offset
 
     # Helper to convert ROI-based points to full-frame
@@ -159,4 +168,5 @@ def build(frame: np.ndarray, result: FrameResult, intersection_is_active:bool =
         cv2.LINE_AA,
     )
 
+    profiler.lap("visualization", t)
     return vis